@@ -57,8 +57,25 @@ COST_ESTIMATION_PROMPT = """
 # モデル設定
 DEFAULT_MODEL = "us.anthropic.claude-3-7-sonnet-20250219-v1:0" 
 
+# AWS Pricing MCP Serverの起動コマンド
+PRICING_MCP_COMMAND = "uvx"
+PRICING_MCP_ARGS = ["awslabs.aws-pricing-mcp-server@latest"]
+# 価格MCPツール定義のキャッシュの有効期間（秒）。@latestのサーバー更新に追従するため期限後に再取得
+PRICING_TOOLS_CACHE_TTL = 3600
+
 # AWSリージョン
 DEFAULT_PROFILE = "default"
 
+# ストリーミングのデルタ判定で保持する前回出力の末尾文字数
+STREAM_DELTA_TAIL_CHARS = 64
+
+# ストリーミング出力をまとめる文字数と最大待機時間（秒）
+STREAM_FLUSH_CHARS = 64
+STREAM_FLUSH_INTERVAL = 0.05
+
+# Code Interpreterセッションのタイムアウト（秒）。keep_alive時はこの時間内にセッションを再作成
+CODE_INTERPRETER_SESSION_TIMEOUT = 3600
+# 見積もりの途中でタイムアウトしないよう、期限のこの秒数前から次の見積もりでセッションを再作成
+SESSION_REFRESH_MARGIN = 300
 # ログ設定
 LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
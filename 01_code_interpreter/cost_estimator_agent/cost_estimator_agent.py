@@ -13,13 +13,19 @@ Amazon Bedrock AgentCore Code Interpreterを使用したAWSコスト見積もり
 - 漸進的な複雑さの構築
 """
 
+import asyncio
 import logging
+import threading
+import time
 import traceback
+from datetime import datetime, timezone
 import boto3
-from contextlib import contextmanager
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager, ExitStack
 from typing import Generator, AsyncGenerator
 from strands import Agent, tool
-from strands.tools.mcp import MCPClient
+from strands.tools.mcp import MCPClient, MCPAgentTool
 from strands.handlers.callback_handler import null_callback_handler
 from mcp import stdio_client, StdioServerParameters
 from bedrock_agentcore.tools.code_interpreter_client import CodeInterpreter
@@ -27,7 +33,15 @@ from cost_estimator_agent.config import (
     SYSTEM_PROMPT,
     COST_ESTIMATION_PROMPT,
     DEFAULT_MODEL,
-    LOG_FORMAT
+    LOG_FORMAT,
+    CODE_INTERPRETER_SESSION_TIMEOUT,
+    SESSION_REFRESH_MARGIN,
+    STREAM_DELTA_TAIL_CHARS,
+    STREAM_FLUSH_CHARS,
+    STREAM_FLUSH_INTERVAL,
+    PRICING_MCP_COMMAND,
+    PRICING_MCP_ARGS,
+    PRICING_TOOLS_CACHE_TTL
 )
 
 # デバッグと監視のための包括的なログ設定
@@ -42,6 +56,26 @@ logging.getLogger("strands").setLevel(logging.ERROR)
 
 logger = logging.getLogger(__name__)
 
+# boto3のSession/クライアント生成はサービスモデルJSONの読み込みを伴い低速なため、
+# プロセス内で一度だけ作成してリクエスト間で再利用
+_SESSION = boto3.Session()
+_STS_CLIENTS = {}  # リージョンごとのSTSクライアント
+_CREDENTIALS = None  # 解決済みの認証情報（ClientError時のみ再取得）
+_IDENTITY_ARN = None  # 確認済みの呼び出し元ID
+_CLIENT_LOCK = threading.Lock()
+# MCP価格ツールの定義（list_toolsの結果）をプロセスの存続期間中保持し、MCPクライアントの起動ごとの往復を省略。
+# キーは(command, args)、値は(取得時刻, ツール定義)。argsは@latestを指すため、PRICING_TOOLS_CACHE_TTL秒を
+# 過ぎた定義は使わずに再取得する（キーは起動コマンドごとに1つのため件数は増えない）
+_TOOLS_CACHE: dict[tuple, tuple[float, list]] = {}
+
+
+def _get_sts_client(region: str):
+    """リージョンごとにキャッシュされたSTSクライアントを取得"""
+    with _CLIENT_LOCK:
+        if region not in _STS_CLIENTS:
+            _STS_CLIENTS[region] = _SESSION.client('sts', region_name=region)
+        return _STS_CLIENTS[region]
+
 
 class AWSCostEstimatorAgent:
     """
@@ -53,18 +87,26 @@ class AWSCostEstimatorAgent:
     - クリーンな実装のためのStrands Agentsフレームワーク
     """
     
-    def __init__(self, region: str = ""):
+    def __init__(self, region: str = "", keep_alive: bool = False):
         """
         コスト見積もりエージェントを初期化
         
         Args:
             region: AgentCore Code InterpreterのAWSリージョン
+            keep_alive: Trueの場合、Code InterpreterセッションとMCPクライアントを
+                見積もり間で維持し、cleanup()で明示的に停止する
         """
         self.region = region
         if not self.region:
-            # 指定されていない場合はboto3セッションからデフォルトリージョンを使用
-            self.region = boto3.Session().region_name
+            # 指定されていない場合はキャッシュ済みboto3セッションからデフォルトリージョンを使用
+            self.region = _SESSION.region_name
+        self.keep_alive = keep_alive
         self.code_interpreter = None
+        self._code_interpreter_started = None  # Code Interpreterセッションの開始時刻（time.monotonic）
+        self._pricing_tools = None  # 起動済みMCPクライアントの価格ツール
+        self._credentials_expiry = None  # MCPクライアントに渡した認証情報の有効期限（time.monotonic、期限なしはNone）
+        self._healthy = True  # Falseの場合、次の見積もりでCode InterpreterとMCPクライアントを再起動
+        self._resources = ExitStack()  # MCPクライアントのコンテキストを保持
         
         logger.info(f"Initializing AWS Cost Estimator Agent in region: {region}")
         
@@ -72,12 +114,50 @@ class AWSCostEstimatorAgent:
         """安全な計算のためのAgentCore Code Interpreterをセットアップ"""
         try:
             logger.info("Setting up AgentCore Code Interpreter...")
-            self.code_interpreter = CodeInterpreter(self.region)
-            self.code_interpreter.start()
+            code_interpreter = CodeInterpreter(self.region)
+            # keep_aliveでの再作成の判定と一致するよう、セッションのタイムアウトを明示的に指定
+            code_interpreter.start(session_timeout_seconds=CODE_INTERPRETER_SESSION_TIMEOUT)
+            # 開始に成功したセッションのみを保持
+            self.code_interpreter = code_interpreter
+            self._code_interpreter_started = time.monotonic()
             logger.info("✅ AgentCore Code Interpreter session started successfully")
         except Exception as e:
             logger.error(f"❌ Failed to setup Code Interpreter: {e}")
-            return  # 再発生させる代わりにエラーを処理
+            return  # 再発生させる代わりにエラーを処理（呼び出し側でcode_interpreterを確認）
+
+    def _stop_code_interpreter(self) -> None:
+        """Code Interpreterセッションを停止（起動していない場合は何もしない）"""
+        if self.code_interpreter:
+            try:
+                self.code_interpreter.stop()
+                logger.info("✅ Code Interpreter session stopped")
+            except Exception as e:
+                logger.warning(f"⚠️ Code Interpreter停止エラー: {e}")
+            finally:
+                self.code_interpreter = None
+                self._code_interpreter_started = None
+
+    def _restart_code_interpreter(self) -> None:
+        """Code Interpreterセッションを作り直す（起動できない場合は例外）"""
+        self._stop_code_interpreter()
+        self._setup_code_interpreter()
+        if self.code_interpreter is None:
+            raise RuntimeError("Code Interpreter session could not be started")
+
+    def _code_interpreter_expiring(self) -> bool:
+        """Code Interpreterセッションのタイムアウトが近いかどうか"""
+        return (
+            self._code_interpreter_started is not None
+            and time.monotonic() - self._code_interpreter_started
+            >= CODE_INTERPRETER_SESSION_TIMEOUT - SESSION_REFRESH_MARGIN
+        )
+
+    def _credentials_expiring(self) -> bool:
+        """MCPクライアントに渡した凍結済み認証情報の有効期限が近いかどうか"""
+        return (
+            self._credentials_expiry is not None
+            and time.monotonic() >= self._credentials_expiry - SESSION_REFRESH_MARGIN
+        )
     
     def _get_aws_credentials(self) -> dict:
         """
@@ -86,24 +166,43 @@ class AWSCostEstimatorAgent:
         Returns:
             セッショントークンを含む現在のAWS認証情報の辞書
         """
+        global _CREDENTIALS, _IDENTITY_ARN
         try:
             logger.info("Getting current AWS credentials...")
             
-            # 現在の認証情報を取得するためのセッションを作成
-            session = boto3.Session()
-            credentials = session.get_credentials()
+            # 認証情報はプロセス内でキャッシュ（リフレッシュ可能な認証情報は
+            # get_frozen_credentials()で自動更新される）
+            if _CREDENTIALS is None:
+                _CREDENTIALS = _SESSION.get_credentials()
+            credentials = _CREDENTIALS
             
             if credentials is None:
                 raise Exception("No AWS credentials found")
             
-            # 呼び出し元のIDを取得して認証情報が機能することを確認
-            sts_client = boto3.client('sts', region_name=self.region)
-            identity = sts_client.get_caller_identity()
-            logger.info(f"Using AWS identity: {identity.get('Arn', 'Unknown')}")
+            # 呼び出し元IDの確認はログ出力のためだけの往復なので、INFOログが有効な場合に
+            # 初回のみ実行（認証情報の欠如はget_frozen_credentials()で検出される）
+            if logger.isEnabledFor(logging.INFO):
+                if _IDENTITY_ARN is None:
+                    try:
+                        identity = _get_sts_client(self.region).get_caller_identity()
+                    except ClientError:
+                        # 認証情報が無効な可能性があるため次回は再取得
+                        _CREDENTIALS = None
+                        raise
+                    _IDENTITY_ARN = identity.get('Arn', 'Unknown')
+                logger.info(f"Using AWS identity: {_IDENTITY_ARN}")
             
             # アクセスするために凍結された認証情報を取得
             frozen_creds = credentials.get_frozen_credentials()
             
+            # MCPサーバーのサブプロセスは凍結した認証情報を使い続けるため、有効期限を記録して期限前に再起動する
+            # （botocoreは一時的な認証情報の有効期限を公開していないため内部属性を参照し、静的な認証情報ではNone）
+            expiry_time = getattr(credentials, "_expiry_time", None)
+            self._credentials_expiry = (
+                time.monotonic() + (expiry_time - datetime.now(timezone.utc)).total_seconds()
+                if expiry_time else None
+            )
+            
             credential_dict = {
                 "AWS_ACCESS_KEY_ID": frozen_creds.access_key,
                 "AWS_SECRET_ACCESS_KEY": frozen_creds.secret_key,
@@ -139,8 +238,8 @@ class AWSCostEstimatorAgent:
             
             aws_pricing_client = MCPClient(
                 lambda: stdio_client(StdioServerParameters(
-                    command="uvx", 
-                    args=["awslabs.aws-pricing-mcp-server@latest"],
+                    command=PRICING_MCP_COMMAND, 
+                    args=PRICING_MCP_ARGS,
                     env=env_vars
                 ))
             )
@@ -166,40 +265,108 @@ class AWSCostEstimatorAgent:
         if not self.code_interpreter:
             return "❌ Code Interpreter not initialized"
             
+        logger.info(f"🧮 Executing calculation: {description}")
+        logger.debug(f"Code to execute:\n{calculation_code}")
         try:
-            logger.info(f"🧮 Executing calculation: {description}")
-            logger.debug(f"Code to execute:\n{calculation_code}")
-            
-            # 安全なAgentCoreサンドボックスでコードを実行
-            response = self.code_interpreter.invoke("executeCode", {
-                "language": "python",
-                "code": calculation_code
-            })
-            
-            # レスポンスストリームから結果を抽出
-            results = []
-            for event in response.get("stream", []):
-                if "result" in event:
-                    result = event["result"]
-                    if "content" in result:
-                        for content_item in result["content"]:
-                            if content_item.get("type") == "text":
-                                results.append(content_item["text"])
-            
-            result_text = "\n".join(results)
-            logger.info("✅ Calculation completed successfully")
-            logger.debug(f"Calculation result: {result_text}")
-            
-            return result_text
-            
+            result_text = self._run_code(calculation_code)
         except Exception as e:
-            logger.exception(f"❌ Calculation failed: {e}")
+            # セッションのタイムアウトなどで失敗した場合は、セッションを作り直して1回だけ再試行
+            logger.warning(f"⚠️ Code Interpreter invoke failed, restarting the session: {e}")
+            try:
+                self._restart_code_interpreter()
+                result_text = self._run_code(calculation_code)
+            except Exception as retry_error:
+                logger.exception(f"❌ Calculation failed: {retry_error}")
+                # 次の見積もりでCode InterpreterとMCPクライアントを再起動
+                self._healthy = False
+                return f"❌ Calculation failed: {retry_error}"
+        
+        logger.info("✅ Calculation completed successfully")
+        logger.debug(f"Calculation result: {result_text}")
+        return result_text
+
+    def _run_code(self, calculation_code: str) -> str:
+        """安全なAgentCoreサンドボックスでコードを実行し、テキスト結果を返す"""
+        response = self.code_interpreter.invoke("executeCode", {
+            "language": "python",
+            "code": calculation_code
+        })
+        
+        # レスポンスストリームからテキスト結果を1パスで抽出して連結
+        return "\n".join(
+            content_item["text"]
+            for event in response.get("stream", ())
+            if "result" in event
+            for content_item in event["result"].get("content", ())
+            if content_item.get("type") == "text"
+        )
+
+    def _open_resources(self) -> list:
+        """
+        Code InterpreterとMCPクライアントを起動し、MCP価格ツールを返す
+        
+        MCPクライアントのコンテキストはself._resourcesに保持され、cleanup()で閉じられます。
+        """
+        # 互いに依存しないコンポーネントを並列にセットアップし、遅い方の待ち時間のみにする
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            code_interpreter_future = executor.submit(self._setup_code_interpreter)
+            pricing_client_future = executor.submit(self._setup_aws_pricing_client)
+            code_interpreter_future.result()
+            aws_pricing_client = pricing_client_future.result()
+        
+        # 計算ツールが使えない状態でエージェントを作成しないよう、セットアップの失敗はここで例外にする
+        if self.code_interpreter is None or aws_pricing_client is None:
+            self._stop_code_interpreter()
+            raise RuntimeError("Failed to start Code Interpreter or AWS Pricing MCP Client")
+        
+        # 永続的なMCPコンテキストを開始
+        self._resources.enter_context(aws_pricing_client)
+        
+        cache_key = (PRICING_MCP_COMMAND, tuple(PRICING_MCP_ARGS))
+        cached = _TOOLS_CACHE.get(cache_key)
+        if cached is None or time.monotonic() - cached[0] >= PRICING_TOOLS_CACHE_TTL:
+            pricing_tools = aws_pricing_client.list_tools_sync()
+            # ツールはMCPクライアントを参照するため、ツール定義のみをキャッシュ
+            _TOOLS_CACHE[cache_key] = (time.monotonic(), [t.mcp_tool for t in pricing_tools])
+        else:
+            # キャッシュしたツール定義を現在のMCPクライアントに結び付けて再構築
+            pricing_tools = [MCPAgentTool(spec, aws_pricing_client) for spec in cached[1]]
+            logger.info("♻️ Using cached AWS pricing tool definitions")
+        logger.info(f"Found {len(pricing_tools)} AWS pricing tools")
+        return pricing_tools
+
+    def _ensure_resources(self) -> None:
+        """
+        Code InterpreterとMCPクライアントを起動、または起動済みのものを検査して再利用
+
+        前回の見積もりで計算が失敗した場合と、MCPクライアントに渡した認証情報の有効期限が
+        近い場合は両方を再起動し、Code Interpreterセッションのタイムアウトが近い場合は
+        Code Interpreterのみを作り直します。
+        """
+        if self._pricing_tools is not None and not self._healthy:
+            logger.warning("⚠️ Previous calculation failed - restarting Code Interpreter and MCP client")
+            self.cleanup()
+        elif self._pricing_tools is not None and self._credentials_expiring():
+            logger.info("🔄 AWS credentials of the MCP client are about to expire - restarting Code Interpreter and MCP client")
+            self.cleanup()
+        
+        if self._pricing_tools is None:
+            self._pricing_tools = self._open_resources()
+            self._healthy = True
+        elif self._code_interpreter_expiring():
+            logger.info("🔄 Code Interpreter session is about to expire - restarting it")
+            self._restart_code_interpreter()
+        else:
+            logger.info("♻️ Reusing running Code Interpreter and MCP client")
 
     @contextmanager
     def _estimation_agent(self) -> Generator[Agent, None, None]:
         """
         コスト見積もりコンポーネントのコンテキストマネージャー
         
+        keep_aliveが有効な場合、2回目以降の呼び出しでは起動済みのCode Interpreterと
+        MCPクライアントを再利用し、会話履歴が混ざらないようエージェントのみ新規作成します。
+        
         Yields:
             全てのツールが設定され、リソースが適切に管理されたエージェント
             
@@ -209,31 +376,57 @@ class AWSCostEstimatorAgent:
         try:
             logger.info("🚀 Initializing AWS Cost Estimation Agent...")
             
-            # コンポーネントを順番にセットアップ
-            self._setup_code_interpreter()
-            aws_pricing_client = self._setup_aws_pricing_client()
+            self._ensure_resources()
             
-            # 永続的なMCPコンテキストでエージェントを作成
-            with aws_pricing_client:
-                pricing_tools = aws_pricing_client.list_tools_sync()
-                logger.info(f"Found {len(pricing_tools)} AWS pricing tools")
+            yield self._build_agent()
                 
-                # execute_cost_calculationとMCP価格ツールの両方でエージェントを作成
-                all_tools = [self.execute_cost_calculation] + pricing_tools
-                agent = Agent(
-                    model=DEFAULT_MODEL,
-                    tools=all_tools,
-                    system_prompt=SYSTEM_PROMPT
-                )
-                
-                yield agent
+        except Exception as e:
+            logger.exception(f"❌ Component setup failed: {e}")
+            # 失敗したセッションは再利用せず、次回の呼び出しで再作成
+            self.cleanup()
+            raise
+        finally:
+            # keep_aliveでない場合は成功/失敗に関係なくクリーンアップが実行されることを保証
+            if not self.keep_alive:
+                self.cleanup()
+
+    @asynccontextmanager
+    async def _aestimation_agent(self) -> AsyncGenerator[Agent, None]:
+        """
+        _estimation_agentの非同期版
+        
+        ブロッキングするセットアップ（Code Interpreterの起動、boto3呼び出し、MCPクライアントの開始）と
+        クリーンアップをワーカースレッドで実行し、イベントループを止めずに他のリクエストと重ね合わせます。
+        
+        Yields:
+            全てのツールが設定され、リソースが適切に管理されたエージェント
+        """
+        try:
+            logger.info("🚀 Initializing AWS Cost Estimation Agent...")
+            
+            await asyncio.to_thread(self._ensure_resources)
+            
+            yield self._build_agent()
                 
         except Exception as e:
             logger.exception(f"❌ Component setup failed: {e}")
+            # 失敗したセッションは再利用せず、次回の呼び出しで再作成
+            await asyncio.to_thread(self.cleanup)
             raise
         finally:
-            # 成功/失敗に関係なくクリーンアップが実行されることを保証
-            self.cleanup()
+            # keep_aliveでない場合は成功/失敗に関係なくクリーンアップが実行されることを保証
+            if not self.keep_alive:
+                await asyncio.to_thread(self.cleanup)
+
+    def _build_agent(self) -> Agent:
+        """起動済みのリソースを使用してリクエストごとのエージェントを作成"""
+        # execute_cost_calculationとMCP価格ツールの両方でエージェントを作成
+        all_tools = [self.execute_cost_calculation] + self._pricing_tools
+        return Agent(
+            model=DEFAULT_MODEL,
+            tools=all_tools,
+            system_prompt=SYSTEM_PROMPT
+        )
 
     def estimate_costs(self, architecture_description: str) -> str:
         """
@@ -296,7 +489,7 @@ class AWSCostEstimatorAgent:
         logger.info(f"Architecture: {architecture_description}")
         
         try:
-            with self._estimation_agent() as agent:
+            async with self._aestimation_agent() as agent:
                 # エージェントを使用してストリーミングでコスト見積もりリクエストを処理
                 prompt = COST_ESTIMATION_PROMPT.format(
                     architecture_description=architecture_description
@@ -306,29 +499,60 @@ class AWSCostEstimatorAgent:
                 
                 # 重複を防ぐための適切なデルタ処理を実装
                 # これはAmazon Bedrock ContentBlockDeltaEventパターンに従います
-                previous_output = ""
+                # 前回出力全体ではなく長さと末尾のみを保持し、イベントごとの
+                # 比較コストを出力長に依存しない定数時間に抑える
+                prev_len = 0
+                prev_tail = ""
+                
+                # 1〜数文字の細かいデルタごとにyieldするとRuntime経由の送信回数が増えるため、
+                # 一定の文字数または時間が経過するまでまとめてから出力
+                pending = []
+                pending_len = 0
+                last_flush = time.monotonic()
                 
                 agent_stream = agent.stream_async(prompt, callback_handler=null_callback_handler)
                 
                 async for event in agent_stream:
                     if "data" in event:
-                        current_chunk = str(event["data"])
+                        # 通常はstrのため、不要な変換を避ける（サブクラスは考慮不要なのでtypeで判定）
+                        data = event["data"]
+                        current_chunk = data if type(data) is str else str(data)
                         
                         # Bedrockのベストプラクティスに従ってデルタ計算を処理
-                        if current_chunk.startswith(previous_output):
+                        if (len(current_chunk) >= prev_len
+                                and current_chunk[prev_len - len(prev_tail):prev_len] == prev_tail):
                             # これは増分更新 - 新しい部分のみを抽出
-                            delta_content = current_chunk[len(previous_output):]
-                            if delta_content:  # 実際に新しいコンテンツがある場合のみ出力
-                                previous_output = current_chunk
-                                yield {"data": delta_content}
+                            delta_content = current_chunk[prev_len:]
+                            if not delta_content:  # 実際に新しいコンテンツがある場合のみ出力
+                                continue
                         else:
                             # これは完全に新しいチャンクまたはリセット - そのまま出力
-                            previous_output = current_chunk
-                            yield {"data": current_chunk}
+                            delta_content = current_chunk
+                        prev_len = len(current_chunk)
+                        prev_tail = current_chunk[-STREAM_DELTA_TAIL_CHARS:]
+                        
+                        pending.append(delta_content)
+                        pending_len += len(delta_content)
+                        now = time.monotonic()
+                        if pending_len >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_INTERVAL:
+                            yield {"data": "".join(pending)}
+                            pending.clear()
+                            pending_len = 0
+                            last_flush = now
                     else:
+                        # 順序を保つため、バッファ済みのテキストを先に出力
+                        if pending:
+                            yield {"data": "".join(pending)}
+                            pending.clear()
+                            pending_len = 0
+                            last_flush = time.monotonic()
                         # 非データイベント（エラー、メタデータなど）を通す
                         yield event
                 
+                # ストリーム終了時に残りのテキストを出力
+                if pending:
+                    yield {"data": "".join(pending)}
+                
                 logger.info("✅ Streaming cost estimation completed")
 
         except Exception as e:
@@ -343,11 +567,13 @@ class AWSCostEstimatorAgent:
         """リソースをクリーンアップ"""
         logger.info("🧹 Cleaning up resources...")
         
-        if self.code_interpreter:
-            try:
-                self.code_interpreter.stop()
-                logger.info("✅ Code Interpreter session stopped")
-            except Exception as e:
-                logger.warning(f"⚠️ Code Interpreter停止エラー: {e}")
-            finally:
-                self.code_interpreter = None
+        # MCPクライアントを停止（起動していない場合は何もしない）
+        try:
+            self._resources.close()
+        except Exception as e:
+            logger.warning(f"⚠️ MCP client停止エラー: {e}")
+        finally:
+            self._pricing_tools = None
+            self._credentials_expiry = None
+        
+        self._stop_code_interpreter()
@@ -1,41 +1,93 @@
 import boto3
+from botocore.exceptions import ClientError
 import yaml
 import os
+import operator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
+from functools import reduce
+
+try:
+    # libyamlが利用可能な場合はCベースの高速なローダーを使用
+    from yaml import CSafeLoader as _YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as _YAMLLoader
+
+# 認証情報と設定の解決を一度だけ行うためにセッションを共有
+_SESSION = boto3.Session()
+
+# 削除対象が既に存在しないことを示すエラーコード
+_NOT_FOUND_ERRORS = {"ResourceNotFoundException", "RepositoryNotFoundException"}
+
+
+def _get_config_value(config: dict, *keys: str):
+    """ネストした設定値を取得し、欠落している場合はどのキーかを示すエラーを発生"""
+    try:
+        return reduce(operator.getitem, keys, config)
+    except (KeyError, TypeError):
+        raise ValueError(f"{'.'.join(keys)} not found in .bedrock_agentcore.yaml") from None
 
 
 def clean_resources():
     with open(".bedrock_agentcore.yaml", "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f) or {}
+        config = yaml.load(f, Loader=_YAMLLoader) or {}
 
-    agent_name = config.get("default_agent")
-    agent_id = config.get("agents").get(agent_name).get("bedrock_agentcore").get("agent_id")
-    ecr_id = config.get("agents").get(agent_name).get("aws").get("ecr_repository")
+    agent_name = _get_config_value(config, "default_agent")
+    agent_id = _get_config_value(config, "agents", agent_name, "bedrock_agentcore", "agent_id")
+    ecr_id = _get_config_value(config, "agents", agent_name, "aws", "ecr_repository")
 
     if not agent_id or not ecr_id:
         raise ValueError("agent_id or ecr_id not found in .bedrock_agentcore.yaml")
 
-    region = boto3.Session().region_name
+    region = _SESSION.region_name
 
-    agentcore_control_client = boto3.client(
+    agentcore_control_client = _SESSION.client(
         'bedrock-agentcore-control',
         region_name=region
     )
-    ecr_client = boto3.client(
+    ecr_client = _SESSION.client(
         'ecr',
         region_name=region
     )
 
-    runtime_delete_response = agentcore_control_client.delete_agent_runtime(
-        agentRuntimeId=agent_id            
-    )
+    # Runtimeの削除とECRリポジトリの削除は互いに独立しているため並列に実行
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            executor.submit(
+                agentcore_control_client.delete_agent_runtime,
+                agentRuntimeId=agent_id
+            ): f"agent runtime {agent_id}",
+            executor.submit(
+                ecr_client.delete_repository,
+                repositoryName=ecr_id.split('/')[-1],
+                force=True
+            ): f"ECR repository {ecr_id}",
+        }
+        failures = []
+        for future in as_completed(futures):
+            try:
+                future.result()
+                print(f"Deleted {futures[future]}.")
+            except ClientError as e:
+                # 前回の実行で削除済みのリソースは削除できたものとして扱う
+                if e.response.get("Error", {}).get("Code") in _NOT_FOUND_ERRORS:
+                    print(f"{futures[future]} is already deleted.")
+                else:
+                    print(f"Failed to delete {futures[future]}: {e}")
+                    failures.append(futures[future])
+            except Exception as e:
+                print(f"Failed to delete {futures[future]}: {e}")
+                failures.append(futures[future])
 
-    response = ecr_client.delete_repository(
-        repositoryName=ecr_id.split('/')[-1],
-        force=True
-    )
+    # .bedrock_agentcore.yamlはagent_id・ecr_idの唯一の記録のため、削除に失敗した場合は残して再実行できるようにする
+    if failures:
+        raise RuntimeError(f"Failed to delete {', '.join(failures)}; keeping .bedrock_agentcore.yaml for retry")
 
-    os.remove(".bedrock_agentcore.yaml")
-    os.remove("Dockerfile")
+    # 部分的なクリーンアップ後の再実行でも失敗しないように、存在しないファイルは無視
+    with suppress(FileNotFoundError):
+        os.remove(".bedrock_agentcore.yaml")
+    with suppress(FileNotFoundError):
+        os.remove("Dockerfile")
 
 
 if __name__ == "__main__":
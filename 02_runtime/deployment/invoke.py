@@ -1,18 +1,27 @@
 import sys
 import os
+import atexit
+import threading
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from cost_estimator_agent.cost_estimator_agent import AWSCostEstimatorAgent
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
 
 app = BedrockAgentCoreApp()
 
+# Code InterpreterセッションとMCPサーバーの起動コストを償却するため、
+# エージェントをモジュールスコープで一度だけ作成してリクエスト間で再利用
+agent = AWSCostEstimatorAgent(keep_alive=True)
+atexit.register(agent.cleanup)
+# 単一のCode Interpreterセッションを共有するため、同時リクエストは直列化
+agent_lock = threading.Lock()
+
 @app.entrypoint
 def invoke(payload):
     user_input = payload.get("prompt")
-    agent = AWSCostEstimatorAgent()
 
     # バッチ
-    return agent.estimate_costs(user_input)
+    with agent_lock:
+        return agent.estimate_costs(user_input)
 
 
 if __name__ == "__main__":
@@ -5,14 +5,23 @@ AgentCore Runtime - エージェント登録・管理ツール
 Amazon Bedrock AgentCore RuntimeにAIエージェントをデプロイするためのシンプルなツール。
 """
 
+import os
 import json
+import hashlib
+import stat
 import shutil
 import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from string import Template
+from typing import Any, Optional
 import boto3
 import click
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # ログ設定
@@ -24,17 +33,233 @@ logger = logging.getLogger(__name__)
 console = Console()
 
 # 定数
-DEFAULT_REGION = boto3.Session().region_name
 DEPLOYMENTS_DIR = Path('./deployment')
+COPY_CHUNK_SIZE = 1024 * 1024  # カーネル内コピー1回あたりの最大バイト数（1 MiB）
+COPY_MAX_WORKERS = min(8, (os.cpu_count() or 1) * 2)  # 並列コピーのスレッド数
+COPY_PARALLEL_THRESHOLD = 4  # これ未満のファイル数ではスレッドを起動せず逐次コピー
+ROLE_CACHE_FILE = '.role_cache.json'  # 解決済みIAMロールのキャッシュ（デプロイメントディレクトリ内）
+
+# boto3クライアントの生成はサービスモデルの読み込みと認証情報の解決を伴うため、
+# 単一のセッションから作成したクライアントを(サービス, リージョン)ごとに再利用
+_SESSION = boto3.Session()
+# 全クライアント共通の接続設定（コネクションプールとキープアライブで呼び出し間のTLS接続を再利用）
+_BOTO_CONFIG = Config(
+    max_pool_connections=16,
+    tcp_keepalive=True,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    connect_timeout=3,
+    read_timeout=10
+)
+_CLIENTS: dict[tuple[str, str], Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_client(service_name: str, region: str):
+    """キャッシュ済みのboto3クライアントを取得（未作成の場合は作成）"""
+    with _CLIENTS_LOCK:
+        key = (service_name, region)
+        if key not in _CLIENTS:
+            _CLIENTS[key] = _SESSION.client(service_name, region_name=region, config=_BOTO_CONFIG)
+        return _CLIENTS[key]
+
+
+# IAMポリシー文書は構造が固定のため、インポート時に一度だけコンパクトなJSON文字列へシリアライズし、
+# 可変部分（リージョン・アカウントID・エージェント名）のみを呼び出しごとに置換する
+_TRUST_POLICY_TEMPLATE = Template(json.dumps({
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Effect": "Allow",
+            "Principal": {
+                "Service": "bedrock-agentcore.amazonaws.com"
+            },
+            "Action": "sts:AssumeRole",
+            "Condition": {
+                "StringEquals": {
+                    "aws:SourceAccount": "${account_id}"
+                },
+                "ArnLike": {
+                    "aws:SourceArn": "arn:aws:bedrock-agentcore:${region}:${account_id}:*"
+                }
+            }
+        }
+    ]
+}, separators=(',', ':')))
+
+_EXECUTION_POLICY_TEMPLATE = Template(json.dumps({
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Sid": "BedrockPermissions",
+            "Effect": "Allow",
+            "Action": [
+                "bedrock:InvokeModel",
+                "bedrock:InvokeModelWithResponseStream"
+            ],
+            "Resource": "*"
+        },
+        {
+            "Sid": "ECRImageAccess",
+            "Effect": "Allow",
+            "Action": [
+                "ecr:BatchGetImage",
+                "ecr:GetDownloadUrlForLayer"
+            ],
+            "Resource": [
+                "arn:aws:ecr:${region}:${account_id}:repository/*"
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "logs:DescribeLogStreams",
+                "logs:CreateLogGroup"
+            ],
+            "Resource": [
+                "arn:aws:logs:${region}:${account_id}:log-group:/aws/bedrock-agentcore/runtimes/*"
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "logs:DescribeLogGroups"
+            ],
+            "Resource": [
+                "arn:aws:logs:${region}:${account_id}:log-group:*"
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "logs:CreateLogStream",
+                "logs:PutLogEvents"
+            ],
+            "Resource": [
+                "arn:aws:logs:${region}:${account_id}:log-group:/aws/bedrock-agentcore/runtimes/*:log-stream:*"
+            ]
+        },
+        {
+            "Sid": "ECRTokenAccess",
+            "Effect": "Allow",
+            "Action": [
+                "ecr:GetAuthorizationToken"
+            ],
+            "Resource": "*"
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "xray:PutTraceSegments",
+                "xray:PutTelemetryRecords",
+                "xray:GetSamplingRules",
+                "xray:GetSamplingTargets"
+                ],
+            "Resource": [ "*" ]
+        },
+        {
+            "Effect": "Allow",
+            "Resource": "*",
+            "Action": "cloudwatch:PutMetricData",
+            "Condition": {
+                "StringEquals": {
+                    "cloudwatch:namespace": "bedrock-agentcore"
+                }
+            }
+        },
+        {
+            "Sid": "GetAgentAccessToken",
+            "Effect": "Allow",
+            "Action": [
+                "bedrock-agentcore:GetWorkloadAccessToken",
+                "bedrock-agentcore:GetWorkloadAccessTokenForJWT",
+                "bedrock-agentcore:GetWorkloadAccessTokenForUserId"
+            ],
+            "Resource": [
+                "arn:aws:bedrock-agentcore:${region}:${account_id}:workload-identity-directory/default*",
+                "arn:aws:bedrock-agentcore:${region}:${account_id}:workload-identity-directory/default/workload-identity/${agent_name}-*"
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "bedrock-agentcore:CreateCodeInterpreter",
+                "bedrock-agentcore:StartCodeInterpreterSession",
+                "bedrock-agentcore:InvokeCodeInterpreter",
+                "bedrock-agentcore:StopCodeInterpreterSession",
+                "bedrock-agentcore:DeleteCodeInterpreter",
+                "bedrock-agentcore:ListCodeInterpreters",
+                "bedrock-agentcore:GetCodeInterpreter",
+                "bedrock-agentcore:GetCodeInterpreterSession",
+                "bedrock-agentcore:ListCodeInterpreterSessions"
+            ],
+            "Resource": "arn:aws:bedrock-agentcore:*:*:*"
+        }
+    ]
+}, separators=(',', ':')))
+
+
+def _policy_hash(document) -> str:
+    """ポリシー文書を正規化（キー順ソート・空白除去）したJSONのSHA-256ハッシュ"""
+    if isinstance(document, str):
+        document = json.loads(document)
+    canonical = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _kernel_copy(in_fd: int, out_fd: int) -> None:
+    """ユーザー空間のバッファを介さずにカーネル内でファイル内容を転送"""
+    if hasattr(os, 'copy_file_range'):
+        while os.copy_file_range(in_fd, out_fd, COPY_CHUNK_SIZE):
+            pass
+        return
+
+    offset = 0
+    while sent := os.sendfile(out_fd, in_fd, offset, COPY_CHUNK_SIZE):
+        offset += sent
+
+
+def _fast_copy(src, dst) -> None:
+    """
+    ファイルの内容をコピー（Linuxではcopy_file_range/sendfileによるゼロコピー）
+
+    カーネルコピーが利用できない環境（Windows等）ではshutil.copyfileにフォールバックする
+    """
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            _kernel_copy(fsrc.fileno(), fdst.fileno())
+    except (AttributeError, OSError):
+        # sendfile非対応のOSやファイルシステム間コピーの失敗時
+        shutil.copyfile(src, dst)
+
+
+def _copy_with_stat(src, dst, st: os.stat_result) -> None:
+    """取得済みのstat情報でメタデータを設定しつつファイルをコピー（copy2相当、再statなし）"""
+    _fast_copy(src, dst)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.chmod(dst, stat.S_IMODE(st.st_mode))
+
+
+@functools.cache
+def _default_region() -> str:
+    """boto3セッションのデフォルトリージョン（インポート時ではなく初回使用時に解決）"""
+    return _SESSION.region_name
+
+
+@functools.cache
+def _account_id(region: str) -> str:
+    """AWSアカウントIDを取得（プロセス内で一度だけSTSを呼び出す）"""
+    return _get_client('sts', region).get_caller_identity()['Account']
 
 
 class AgentPreparer:
     """デプロイメント用のエージェント準備を処理"""
     
-    def __init__(self, source_dir: str, region: str = DEFAULT_REGION):
+    def __init__(self, source_dir: str, region: str = ""):
         self.source_dir = Path(source_dir)
-        self.region = region
-        self.iam_client = boto3.client('iam', region_name=region)
+        # エージェント名は呼び出しのたびにファイルシステムを確認しないよう一度だけ解決
+        self._agent_name = self.source_dir.name if self.source_dir.is_dir() else self.source_dir.stem
+        self.region = region or _default_region()
+        self.iam_client = _get_client('iam', self.region)
     
     @property
     def agent_name(self) -> str:
@@ -44,7 +269,7 @@ class AgentPreparer:
         Returns:
             str: エージェントの名前
         """
-        return self.source_dir.name if self.source_dir.is_dir() else self.source_dir.stem
+        return self._agent_name
 
     def prepare(self) -> str:
         """
@@ -87,10 +312,21 @@ class AgentPreparer:
 
         # ソースディレクトリからPythonファイルをコピー
         logger.info(f"Copying Python files from {self.source_dir} to {target_dir}")
-        for file_path in self.source_dir.glob("*.py"):
-            dest_path = target_dir / file_path.name
-            shutil.copy2(file_path, dest_path)
-            logger.info(f"Copied {file_path.name}")
+        # scandirの1パスでエントリとstat情報を取得し、コピー時の再statを避ける
+        with os.scandir(self.source_dir) as it:
+            entries = [e for e in it if e.is_file() and e.name.endswith('.py')]
+
+        def copy_entry(entry: os.DirEntry) -> None:
+            _copy_with_stat(entry.path, target_dir / entry.name, entry.stat())
+            logger.info(f"Copied {entry.name}")
+
+        if len(entries) < COPY_PARALLEL_THRESHOLD:
+            for entry in entries:
+                copy_entry(entry)
+        else:
+            # コピー中のシステムコールはGILを解放するため、スレッドでI/Oを重ねる
+            with ThreadPoolExecutor(max_workers=COPY_MAX_WORKERS) as executor:
+                list(executor.map(copy_entry, entries))
             
         logger.info(f"Source directory is copied to deployment directory: {DEPLOYMENTS_DIR}")
         return str(DEPLOYMENTS_DIR)
@@ -106,174 +342,71 @@ class AgentPreparer:
         role_name = f"AgentCoreRole-{self.agent_name}"
         logger.info(f"Creating IAM role: {role_name}")
         
-        # アカウントIDを取得
-        sts_client = boto3.client('sts', region_name=self.region)
-        account_id = sts_client.get_caller_identity()['Account']
-        
-        # 信頼ポリシーを作成
-        trust_policy = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Principal": {
-                        "Service": "bedrock-agentcore.amazonaws.com"
-                    },
-                    "Action": "sts:AssumeRole",
-                    "Condition": {
-                        "StringEquals": {
-                            "aws:SourceAccount": account_id
-                        },
-                        "ArnLike": {
-                            "aws:SourceArn": f"arn:aws:bedrock-agentcore:{self.region}:{account_id}:*"
-                        }
-                    }
-                }
-            ]
-        }
-        
-        # 実行ポリシーを作成
-        execution_policy = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Sid": "BedrockPermissions",
-                    "Effect": "Allow",
-                    "Action": [
-                        "bedrock:InvokeModel",
-                        "bedrock:InvokeModelWithResponseStream"
-                    ],
-                    "Resource": "*"
-                },
-                {
-                    "Sid": "ECRImageAccess",
-                    "Effect": "Allow",
-                    "Action": [
-                        "ecr:BatchGetImage",
-                        "ecr:GetDownloadUrlForLayer"
-                    ],
-                    "Resource": [
-                        f"arn:aws:ecr:{self.region}:{account_id}:repository/*"
-                    ]
-                },
-                {
-                    "Effect": "Allow",
-                    "Action": [
-                        "logs:DescribeLogStreams",
-                        "logs:CreateLogGroup"
-                    ],
-                    "Resource": [
-                        f"arn:aws:logs:{self.region}:{account_id}:log-group:/aws/bedrock-agentcore/runtimes/*"
-                    ]
-                },
-                {
-                    "Effect": "Allow",
-                    "Action": [
-                        "logs:DescribeLogGroups"
-                    ],
-                    "Resource": [
-                        f"arn:aws:logs:{self.region}:{account_id}:log-group:*"
-                    ]
-                },
-                {
-                    "Effect": "Allow",
-                    "Action": [
-                        "logs:CreateLogStream",
-                        "logs:PutLogEvents"
-                    ],
-                    "Resource": [
-                        f"arn:aws:logs:{self.region}:{account_id}:log-group:/aws/bedrock-agentcore/runtimes/*:log-stream:*"
-                    ]
-                },
-                {
-                    "Sid": "ECRTokenAccess",
-                    "Effect": "Allow",
-                    "Action": [
-                        "ecr:GetAuthorizationToken"
-                    ],
-                    "Resource": "*"
-                },
-                {
-                    "Effect": "Allow",
-                    "Action": [
-                        "xray:PutTraceSegments",
-                        "xray:PutTelemetryRecords",
-                        "xray:GetSamplingRules",
-                        "xray:GetSamplingTargets"
-                        ],
-                    "Resource": [ "*" ]
-                },
-                {
-                    "Effect": "Allow",
-                    "Resource": "*",
-                    "Action": "cloudwatch:PutMetricData",
-                    "Condition": {
-                        "StringEquals": {
-                            "cloudwatch:namespace": "bedrock-agentcore"
-                        }
-                    }
-                },
-                {
-                    "Sid": "GetAgentAccessToken",
-                    "Effect": "Allow",
-                    "Action": [
-                        "bedrock-agentcore:GetWorkloadAccessToken",
-                        "bedrock-agentcore:GetWorkloadAccessTokenForJWT",
-                        "bedrock-agentcore:GetWorkloadAccessTokenForUserId"
-                    ],
-                    "Resource": [
-                        f"arn:aws:bedrock-agentcore:{self.region}:{account_id}:workload-identity-directory/default*",
-                        f"arn:aws:bedrock-agentcore:{self.region}:{account_id}:workload-identity-directory/default/workload-identity/{self.agent_name}-*"
-                    ]
-                },
-                {
-                    "Effect": "Allow",
-                    "Action": [
-                        "bedrock-agentcore:CreateCodeInterpreter",
-                        "bedrock-agentcore:StartCodeInterpreterSession",
-                        "bedrock-agentcore:InvokeCodeInterpreter",
-                        "bedrock-agentcore:StopCodeInterpreterSession",
-                        "bedrock-agentcore:DeleteCodeInterpreter",
-                        "bedrock-agentcore:ListCodeInterpreters",
-                        "bedrock-agentcore:GetCodeInterpreter",
-                        "bedrock-agentcore:GetCodeInterpreterSession",
-                        "bedrock-agentcore:ListCodeInterpreterSessions"
-                    ],
-                    "Resource": "arn:aws:bedrock-agentcore:*:*:*"
-                }
-            ]
-        }
-        
+        # 前回の実行で解決済みのロールがあればポリシーの確認・更新を省略
+        cached_role = self._load_cached_role(role_name)
+
         role_exists = False
-        response = None
+        role_arn = None
+        role_id = None
 
-        try:
-            response = self.iam_client.get_role(RoleName=role_name)
-            logger.info(f"Role {role_name} already exists")
-            role_exists = True
-        except ClientError:
-            pass
+        # アカウントID取得（STS）とロールの存在確認（IAM）は独立しているため並行して実行
+        # （キャッシュがある場合も、ロールが削除・再作成されていないかをget_roleで確認）
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            account_future = executor.submit(_account_id, self.region)
+            role_future = executor.submit(self.iam_client.get_role, RoleName=role_name)
+
+            account_id = account_future.result()
+            try:
+                role = role_future.result()['Role']
+                role_arn = role['Arn']
+                role_id = role['RoleId']
+                logger.info(f"Role {role_name} already exists")
+                role_exists = True
+            except self.iam_client.exceptions.NoSuchEntityException:
+                pass
+
+        # 信頼ポリシー・実行ポリシーを作成（事前シリアライズ済みテンプレートに値を埋め込む）
+        policy_values = {'region': self.region, 'account_id': account_id, 'agent_name': self.agent_name}
+        trust_policy = _TRUST_POLICY_TEMPLATE.substitute(policy_values)
+        execution_policy = _EXECUTION_POLICY_TEMPLATE.substitute(policy_values)
+        policy_name = f'{role_name}-ExecutionPolicy'
+        policy_hash = _policy_hash(execution_policy)
+
+        # キャッシュしたロールと同一のロール（RoleIdが一致）で、ポリシーが現在のテンプレートと同一であれば
+        # ポリシーの確認・更新を省略
+        if (cached_role and role_exists and cached_role.get('role_id') == role_id
+                and cached_role.get('policy_hash') == policy_hash):
+            logger.info(f"Using cached role: {role_arn}")
+            return {
+                'agent_name': self.agent_name,
+                'role_name': role_name,
+                'role_arn': role_arn
+            }
 
         if not role_exists:
             try:
                 # ロールを作成
                 response = self.iam_client.create_role(
                     RoleName=role_name,
-                    AssumeRolePolicyDocument=json.dumps(trust_policy),
+                    AssumeRolePolicyDocument=trust_policy,
                     Description=f'AgentCore execution role for {self.agent_name}'
                 )
+                role_arn = response['Role']['Arn']
+                role_id = response['Role']['RoleId']
                 logger.info(f"IAM role created successfully: {role_name}")
                 
             except ClientError as e:
                 logger.error(f"Failed to create IAM role: {e}")
                 return {}  # 失敗を示すために空の辞書を返す
 
-            # 実行ポリシーが確実にアタッチされるようにする（新規・既存ロール両方）
+        # 実行ポリシーが確実にアタッチされるようにする（新規・既存ロール両方）
+        # 既存ロールでアタッチ済みのポリシーが同一の場合は書き込みを省略
+        if not (role_exists and self._current_policy_hash(role_name, policy_name) == policy_hash):
             try:
                 self.iam_client.put_role_policy(
                     RoleName=role_name,
-                    PolicyName=f'{role_name}-ExecutionPolicy',
-                    PolicyDocument=json.dumps(execution_policy)
+                    PolicyName=policy_name,
+                    PolicyDocument=execution_policy
                 )
                     
                 logger.info(f"Execution policy attached to role: {role_name}")
@@ -281,17 +414,55 @@ class AgentPreparer:
             except ClientError as e:
                 logger.error(f"Failed to attach execution policy: {e}")
                 return {}  # 失敗を示すために空の辞書を返す
+        else:
+            logger.info(f"Execution policy is up to date: {role_name}")
+
+        self._save_cached_role(role_name, role_arn, role_id, policy_hash)
 
         return {
             'agent_name': self.agent_name,
             'role_name': role_name,
-            'role_arn': response['Role']['Arn']
+            'role_arn': role_arn
         }
 
+    def _current_policy_hash(self, role_name: str, policy_name: str) -> Optional[str]:
+        """ロールにアタッチ済みのインラインポリシーのハッシュを取得（未アタッチの場合はNone）"""
+        try:
+            response = self.iam_client.get_role_policy(RoleName=role_name, PolicyName=policy_name)
+        except self.iam_client.exceptions.NoSuchEntityException:
+            return None
+        return _policy_hash(response['PolicyDocument'])
+
+    @property
+    def role_cache_path(self) -> Path:
+        """IAMロールキャッシュファイルのパス"""
+        return DEPLOYMENTS_DIR / self.agent_name / ROLE_CACHE_FILE
+
+    def _load_cached_role(self, role_name: str) -> Optional[dict]:
+        """キャッシュ済みのロール情報を読み込み（ロール名が一致する場合のみ）"""
+        try:
+            cached = json.loads(self.role_cache_path.read_bytes())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if cached.get('role_name') == role_name and cached.get('role_arn'):
+            return cached
+        return None
+
+    def _save_cached_role(self, role_name: str, role_arn: str, role_id: str, policy_hash: str) -> None:
+        """解決したロール情報をキャッシュファイルに保存"""
+        self.role_cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.role_cache_path.write_text(
+            json.dumps(
+                {'role_name': role_name, 'role_arn': role_arn, 'role_id': role_id, 'policy_hash': policy_hash},
+                indent=2
+            ),
+            encoding='utf-8'
+        )
 
 @click.command()
 @click.option('--source-dir', default="../01_code_interpreter/cost_estimator_agent", required=True, help='Source directory to copy')
-@click.option('--region', default=DEFAULT_REGION, help='AWS region')
+@click.option('--region', default=_default_region, help='AWS region')
 def prepare(source_dir: str, region: str):
     """ソースディレクトリをコピーしてエージェントをデプロイメント用に準備"""
     console.print(f"[bold blue]Preparing agent from: {source_dir}[/bold blue]")
@@ -1,49 +1,81 @@
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import boto3
+from botocore.config import Config
+
+# 全クライアント共通の接続設定（コネクションプールとキープアライブで呼び出し間のTLS接続を再利用）
+_BOTO_CONFIG = Config(
+    max_pool_connections=16,
+    tcp_keepalive=True,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    connect_timeout=3,
+    read_timeout=10
+)
 
 
 def clean_resources():
     """アイデンティティ設定で作成されたすべてのリソースをクリーンアップ"""
     config_file = Path("inbound_authorizer.json")
 
-    with config_file.open("r", encoding="utf-8") as f:
-        config = json.load(f)
+    # バイト列のまま読み込んで直接パース（json.loadsはUTF-8のバイト列を受け付ける）
+    config = json.loads(config_file.read_bytes())
 
     region = boto3.Session().region_name
     
-    # AgentCore OAuth2認証情報プロバイダーをクリーンアップ
-    client = boto3.client("bedrock-agentcore-control", region_name=region)
+    # boto3クライアントはスレッドセーフなため、各クライアントを一度だけ作成して並列呼び出しで共有
+    client = boto3.client("bedrock-agentcore-control", region_name=region, config=_BOTO_CONFIG)
+    cognito_client = boto3.client("cognito-idp", region_name=region, config=_BOTO_CONFIG)
     provider_name = config["provider"]["name"]
-    print(f"Deleting OAuth2 credential provider: {provider_name}")
-    client.delete_oauth2_credential_provider(name=provider_name)
-    print(f"OAuth2 credential provider {provider_name} deleted successfully")
-
-    # Cognitoリソースをクリーンアップ
-    cognito_client = boto3.client("cognito-idp", region_name=region)
     user_pool_id = config["cognito"]["user_pool_id"]
     client_id = config["cognito"]["client_id"]
+    runtime_id = config["runtime"]["id"]
 
-    # ユーザープールクライアントを削除
-    print(f"Deleting user pool client: {client_id}")
-    cognito_client.delete_user_pool_client(
-        UserPoolId=user_pool_id,
-        ClientId=client_id
-    )
-    print(f"User pool client {client_id} deleted successfully")
+    def delete_provider():
+        # AgentCore OAuth2認証情報プロバイダーをクリーンアップ
+        print(f"Deleting OAuth2 credential provider: {provider_name}")
+        client.delete_oauth2_credential_provider(name=provider_name)
+        print(f"OAuth2 credential provider {provider_name} deleted successfully")
 
-    user_pool_details = cognito_client.describe_user_pool(UserPoolId=user_pool_id)
-    domain = user_pool_details.get("UserPool", {}).get("Domain")
-    
-    if domain:
-        print(f"Deleting user pool domain: {domain}")
-        cognito_client.delete_user_pool_domain(Domain=domain, UserPoolId=user_pool_id)
-        print(f"Domain {domain} deleted successfully")
-    else:
-        print("No domain found for user pool")
-
-    # 削除保護を無効化してユーザープールを削除
+    def delete_user_pool_client():
+        # ユーザープールクライアントを削除
+        print(f"Deleting user pool client: {client_id}")
+        cognito_client.delete_user_pool_client(
+            UserPoolId=user_pool_id,
+            ClientId=client_id
+        )
+        print(f"User pool client {client_id} deleted successfully")
+
+    def delete_runtime():
+        print(f"Deleting agent runtime: {runtime_id}")
+        client.delete_agent_runtime(agentRuntimeId=runtime_id)
+        print(f"Agent runtime {runtime_id} deleted successfully")
+
+    # 互いに依存しない呼び出しを並列に実行し、待ち時間を合計ではなく最大値にする
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [
+            executor.submit(delete_provider),
+            executor.submit(delete_user_pool_client),
+            executor.submit(delete_runtime),
+        ]
+        describe_future = executor.submit(cognito_client.describe_user_pool, UserPoolId=user_pool_id)
+
+        # ドメインの削除はdescribe_user_poolの結果に依存
+        user_pool_details = describe_future.result()
+        domain = user_pool_details.get("UserPool", {}).get("Domain")
+        
+        if domain:
+            print(f"Deleting user pool domain: {domain}")
+            cognito_client.delete_user_pool_domain(Domain=domain, UserPoolId=user_pool_id)
+            print(f"Domain {domain} deleted successfully")
+        else:
+            print("No domain found for user pool")
+
+        for future in futures:
+            future.result()
+
+    # Cognitoの要件に従い、削除保護の無効化 → ユーザープール削除の順に実行
     print(f"Disabling deletion protection for user pool: {user_pool_id}")
     cognito_client.update_user_pool(
         UserPoolId=user_pool_id,
@@ -54,11 +86,6 @@ def clean_resources():
     cognito_client.delete_user_pool(UserPoolId=user_pool_id)
     print(f"User pool {user_pool_id} deleted successfully")
 
-    runtime_id = config["runtime"]["id"]
-    runtime_delete_response = client.delete_agent_runtime(
-        agentRuntimeId=runtime_id
-    )
-
     os.remove(".agentcore.json")
     os.remove("inbound_authorizer.json")
 
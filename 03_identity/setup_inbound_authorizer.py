@@ -13,18 +13,18 @@ AgentCore Identityが認証されたAPI呼び出しのためのアクセスト
 """
 
 import json
-import boto3
 import logging
 import argparse
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cache, lru_cache
 from pathlib import Path
 from typing import Optional
-import urllib.parse
-import requests
+from urllib.parse import quote_from_bytes
 from rich.console import Console
 from rich.panel import Panel
-from bedrock_agentcore_starter_toolkit.operations.gateway.client import GatewayClient
-import yaml
+# boto3・requests・yaml・starter toolkitは読み込みが重いため、使用する関数内でインポートする
+# （ランタイム未デプロイで早期終了する場合や--helpの起動を速くするため）
 
 
 # 明確なデバッグのためのログ設定
@@ -34,6 +34,50 @@ logger = logging.getLogger(__name__)
 PROVIDER_NAME = "inbound-identity-for-cost-estimator-agent"
 CONFIG_FILE = Path("inbound_authorizer.json")
 
+
+@cache
+def _http_session():
+    """
+    HTTPセッションを取得（初回呼び出し時に作成）
+
+    HTTP接続を呼び出し間で再利用（TLSハンドシェイクを毎回行わない）し、一時的なゲートウェイエラーは再試行
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry
+
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+    ))
+    return session
+
+
+@cache
+def _boto_session():
+    """boto3セッションを取得（認証情報の解決を一度だけ行うため共有）"""
+    import boto3
+    return boto3.Session()
+
+
+@cache
+def _region() -> str:
+    """
+    デフォルトリージョンを取得（初回のみ解決）
+
+    他のスクリプトと同じリソースのリージョンになるよう、boto3セッションの解決結果をそのまま使用
+    """
+    return _boto_session().region_name
+
+
+@cache
+def _client(service_name: str, region: Optional[str] = None):
+    """キャッシュ済みのboto3クライアントを取得（サービス・リージョンごとに一度だけ作成）"""
+    return _boto_session().client(service_name, region_name=region)
+
+
 def setup_oauth2_credential_provider(provider_name: str = PROVIDER_NAME, force: bool = False) -> dict:
     """
     AgentCore Identity用のOAuth2認証情報プロバイダーをセットアップ。
@@ -51,178 +95,222 @@ def setup_oauth2_credential_provider(provider_name: str = PROVIDER_NAME, force:
         dict: 設定
     """
 
-    config = load_config()
-    region = boto3.Session().region_name
+    region = _region()
+    identity_client = _client('bedrock-agentcore-control', region)
 
-    has_cognito = config and 'cognito' in config
-    has_provider = config and 'provider' in config
+    # 設定の読み込みは一度だけ行い、更新はメモリ上で行って終了時（例外発生時も含む）にまとめて書き出す
+    with ConfigStore() as store:
+        config = store.data
 
-    identity_client = boto3.client('bedrock-agentcore-control', region_name=region)
+        has_cognito = 'cognito' in config
+        has_provider = 'provider' in config
+
+        # すべてが完了しており、強制しない場合は、概要を表示して終了
+        if has_cognito and has_provider and not force:
+            logger.info("All components already configured (use --force to recreate)")
+            return config
 
-    # すべてが完了しており、強制しない場合は、概要を表示して終了
-    if config and has_cognito and has_provider and not force:
-        logger.info("All components already configured (use --force to recreate)")
-        return config
-    elif config:
         if has_provider and force:
             logger.info("Delete existing OAuth2 credential provider...")
             identity_client.delete_oauth2_credential_provider(name=provider_name)
-            save_config(delete_key="provider")
+            del config["provider"]
             has_provider = False
         if has_cognito and force:
             logger.info("Delete existing Cognito OAuth authorizer...")
             cleanup_cognito_resources(config['cognito'])
-            save_config(delete_key="cognito")
+            del config["cognito"]
             has_cognito = False
     
-    cognito_config = {}
-    if not has_cognito:
-        logger.info("Creating Cognito OAuth authorizer...")
-        gateway_client = GatewayClient(region_name=region)
-        # Gateway ClientからCognitoでOAuthオーソライザーを作成するためのシンプルなインターフェースを使用
-        cognito_result = gateway_client.create_oauth_authorizer_with_cognito("InboundAuthorizerForCostEstimatorAgent")
-        user_pool_id = cognito_result['client_info']['user_pool_id']
-        discovery_url = f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/openid-configuration"
-        cognito_config = {
-            "client_id": cognito_result['client_info']['client_id'],
-            "client_secret": cognito_result['client_info']['client_secret'],
-            "token_endpoint": cognito_result['client_info']['token_endpoint'],
-            "discovery_url": discovery_url,
-            "scope": cognito_result['client_info']['scope'],
-            "user_pool_id": user_pool_id,
-            "region": region
-        }
-        save_config({"cognito" : cognito_config})
-        logger.info("✅ Cognito configuration saved")
-
-    provider_config = {}
-    if not has_provider:
-        logger.info("Creating Identity Provider ...")
-        # 新しい認証情報プロバイダー設定を作成
-        # https://docs.aws.amazon.com/bedrock-agentcore-control/latest/APIReference/API_CustomOauth2ProviderConfigInput.html
-        # https://docs.aws.amazon.com/bedrock-agentcore-control/latest/APIReference/API_Oauth2Discovery.html
-        wait_for_oidc_endpoint(discovery_url)
-        oauth2_config = {
-            'customOauth2ProviderConfig': {
-                'clientId': cognito_config['client_id'],
-                'clientSecret': cognito_config['client_secret'],
-                'oauthDiscovery': {
-                    'discoveryUrl': cognito_config['discovery_url']
+        # 既存のCognito設定がある場合も以降の処理でディスカバリーURLとクライアント情報を参照できるようにする
+        cognito_config = config.get('cognito') or {}
+        discovery_url = cognito_config.get('discovery_url')
+        if not has_cognito:
+            logger.info("Creating Cognito OAuth authorizer...")
+            from bedrock_agentcore_starter_toolkit.operations.gateway.client import GatewayClient
+            gateway_client = GatewayClient(region_name=region)
+            # Gateway ClientからCognitoでOAuthオーソライザーを作成するためのシンプルなインターフェースを使用
+            cognito_result = gateway_client.create_oauth_authorizer_with_cognito("InboundAuthorizerForCostEstimatorAgent")
+            user_pool_id = cognito_result['client_info']['user_pool_id']
+            discovery_url = f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/openid-configuration"
+            cognito_config = {
+                "client_id": cognito_result['client_info']['client_id'],
+                "client_secret": cognito_result['client_info']['client_secret'],
+                "token_endpoint": cognito_result['client_info']['token_endpoint'],
+                "discovery_url": discovery_url,
+                "scope": cognito_result['client_info']['scope'],
+                "user_pool_id": user_pool_id,
+                "region": region
+            }
+            config["cognito"] = cognito_config
+            logger.info("✅ Cognito configuration saved")
+
+        if not has_provider:
+            logger.info("Creating Identity Provider ...")
+            # 新しい認証情報プロバイダー設定を作成
+            # https://docs.aws.amazon.com/bedrock-agentcore-control/latest/APIReference/API_CustomOauth2ProviderConfigInput.html
+            # https://docs.aws.amazon.com/bedrock-agentcore-control/latest/APIReference/API_Oauth2Discovery.html
+            # 以前の実行で同じユーザープールのディスカバリードキュメントを取得済みであれば待機を省略
+            oidc_config = config.get('oidc', {})
+            if discovery_url != f"{oidc_config.get('issuer')}/.well-known/openid-configuration":
+                oidc_config = wait_for_oidc_endpoint(discovery_url)
+                if oidc_config:
+                    config["oidc"] = oidc_config
+            oauth2_config = {
+                'customOauth2ProviderConfig': {
+                    'clientId': cognito_config['client_id'],
+                    'clientSecret': cognito_config['client_secret'],
+                    'oauthDiscovery': {
+                        'discoveryUrl': cognito_config['discovery_url']
+                    }
                 }
             }
-        }
 
-        # APIリファレンス: https://docs.aws.amazon.com/bedrock-agentcore-control/latest/APIReference/API_CreateOauth2CredentialProvider.html
-        response = identity_client.create_oauth2_credential_provider(
-            name=provider_name,
-            credentialProviderVendor='CustomOauth2',
-            oauth2ProviderConfigInput=oauth2_config
-        )
+            # APIリファレンス: https://docs.aws.amazon.com/bedrock-agentcore-control/latest/APIReference/API_CreateOauth2CredentialProvider.html
+            response = identity_client.create_oauth2_credential_provider(
+                name=provider_name,
+                credentialProviderVendor='CustomOauth2',
+                oauth2ProviderConfigInput=oauth2_config
+            )
 
-        provider_config = {
-            "name": provider_name,
-            "arn" : response['credentialProviderArn']
-        }
-        save_config({"provider": provider_config})
-        logger.info("✅ Provider configuration saved")
+            config["provider"] = {
+                "name": provider_name,
+                "arn" : response['credentialProviderArn']
+            }
+            logger.info("✅ Provider configuration saved")
         
-        return load_config()
+        return config
 
 
-def load_config() -> dict:
-    if CONFIG_FILE.exists():
-        with CONFIG_FILE.open('r') as f:
-                config = json.load(f)
-        return config
-    else:
-        return {}
+class ConfigStore:
+    """
+    inbound_authorizer.jsonの設定を管理するコンテキストマネージャー
 
+    開始時にファイルを一度だけ読み込み、dataへの変更は終了時にまとめて書き出す。
+    途中で例外が発生しても作成済みリソースの情報を失わないよう、終了時は常に保存する。
+    """
 
-def save_config(updates: Optional[dict]=None, delete_key: str=""):
-    """新しいデータで設定ファイルを更新"""
-    config = load_config()
-    
-    if updates is not None:
-        config.update(updates)
-    elif delete_key:
-        del config[delete_key]
-    
-    with CONFIG_FILE.open('w') as f:
-        json.dump(config, f, indent=2)
+    def __init__(self, path: Path = CONFIG_FILE):
+        self.path = path
+        self.data: dict = {}
+        self._raw = ""
+
+    def __enter__(self) -> "ConfigStore":
+        if self.path.exists():
+            self._raw = self.path.read_text(encoding='utf-8')
+            self.data = json.loads(self._raw)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # 内容に変更がない場合は書き込みを省略
+        serialized = json.dumps(self.data, indent=2)
+        if serialized != self._raw:
+            self.path.write_text(serialized, encoding='utf-8')
 
 
 def cleanup_cognito_resources(cognito_config):
     """Cognitoリソースを明示的にクリーンアップ"""
-    if not cognito_config.get('user_pool_id'):    
-        try:
-            cognito_client = boto3.client('cognito-idp')
-            user_pool_id = cognito_config['user_pool_id']
+    if not cognito_config.get('user_pool_id'):
+        return
 
-            cognito_client.delete_user_pool_client(
-                UserPoolId=user_pool_id,
-                ClientId=cognito_config['client_id']
-            )
+    try:
+        cognito_client = _client('cognito-idp', cognito_config.get('region'))
+        user_pool_id = cognito_config['user_pool_id']
 
+        def delete_domain():
             user_pool_details = cognito_client.describe_user_pool(UserPoolId=user_pool_id)
             domain = user_pool_details.get("UserPool", {}).get("Domain")
             
             if domain:
                 cognito_client.delete_user_pool_domain(Domain=domain, UserPoolId=user_pool_id)
 
-            cognito_client.update_user_pool(
-                UserPoolId=user_pool_id,
-                DeletionProtection='INACTIVE'
-            )
-
-            cognito_client.delete_user_pool(UserPoolId=user_pool_id)
-            
-        except Exception as e:
-            logger.warning(f"Cognito cleanup error: {e}")
-
-
-def wait_for_oidc_endpoint(oidc_url, max_wait=600, interval=30):
+        # クライアント削除・ドメイン削除・削除保護の無効化は互いに独立しているため並列に実行
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(
+                    cognito_client.delete_user_pool_client,
+                    UserPoolId=user_pool_id,
+                    ClientId=cognito_config['client_id']
+                ),
+                executor.submit(delete_domain),
+                executor.submit(
+                    cognito_client.update_user_pool,
+                    UserPoolId=user_pool_id,
+                    DeletionProtection='INACTIVE'
+                ),
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+        cognito_client.delete_user_pool(UserPoolId=user_pool_id)
+        
+    except Exception as e:
+        logger.warning("Cognito cleanup error: %s", e)
+
+
+@lru_cache(maxsize=8)
+def _fetch_oidc(oidc_url: str) -> dict:
+    """OIDCディスカバリードキュメントを取得して解析（有効なドキュメントのみキャッシュされる）"""
+    response = _http_session().get(oidc_url, timeout=10)
+    # HTTPエラーステータスコード（4xx、5xx）に対して例外を発生
+    response.raise_for_status()
+    # issuerを含まない応答はパースせずに除外し、本文のバイト列を一度だけパース
+    # （response.json()のような文字コード推定とテキストデコードを経由しない）
+    if b'"issuer"' not in response.content:
+        raise KeyError('issuer')
+    json_data = json.loads(response.content)
+    if 'issuer' not in json_data:
+        raise KeyError('issuer')
+    return json_data
+
+
+def wait_for_oidc_endpoint(oidc_url, max_wait=600, max_interval=30) -> Optional[dict]:
     """OIDCディスカバリーエンドポイントが利用可能になるまで待機
     
     実際のテストに基づくと、DNS伝播とサービス初期化の遅延により、
 OIDCエンドポイントが利用可能になるまでに5分以上かかる場合があります。
+    待機間隔は1秒から指数的に延ばし、max_intervalで頭打ちにします。
+
+    Returns:
+        解析済みのディスカバリードキュメント（タイムアウト時はNone）
     """
-    start_time = time.time()
+    import requests
+
+    start_time = time.monotonic()
     attempt = 1
     
-    logger.info(f"⏳ Waiting for OIDC endpoint: {oidc_url}")
-    logger.info(f"⏳ Timeout: {max_wait}s, Check interval: {interval}s")
+    logger.info("⏳ Waiting for OIDC endpoint: %s", oidc_url)
+    logger.info("⏳ Timeout: %ss, Max check interval: %ss", max_wait, max_interval)
     
-    while time.time() - start_time < max_wait:
-        response = requests.get(oidc_url, timeout=10)
-        logger.info(f"⏳ Attempt {attempt}: HTTP {response.status_code}")
-        
-        # HTTPエラーステータスコード（4xx、5xx）に対して例外を発生
-        response.raise_for_status()
-        
-        if response.status_code == 200:
-            elapsed = time.time() - start_time
-            logger.info(f"✅ OIDC endpoint available after {elapsed:.1f}s")
-            # 実際に有効なJSONであることを確認
-            try:
-                json_data = response.json()
-                if 'issuer' in json_data:
-                    logger.info("✅ OIDC discovery document is valid")
-                    return True
-                else:
-                    logger.warning("⚠️ OIDC response missing 'issuer' field")
-            except ValueError:
-                logger.warning("⚠️ OIDC response is not valid JSON")
+    while True:
+        try:
+            # 軽量なHEADリクエストで準備完了を確認し、利用可能になってから一度だけGETで取得
+            response = _http_session().head(oidc_url, timeout=5, allow_redirects=True)
+            logger.info("⏳ Attempt %d: HTTP %d", attempt, response.status_code)
+            # HEAD非対応（405/501）の場合もGETで確認
+            if response.status_code in (200, 405, 501):
+                json_data = _fetch_oidc(oidc_url)
+                elapsed = time.monotonic() - start_time
+                logger.info("✅ OIDC endpoint available after %.1fs", elapsed)
+                logger.info("✅ OIDC discovery document is valid")
+                return json_data
+        except KeyError:
+            logger.warning("⚠️ OIDC response missing 'issuer' field")
+        except ValueError:
+            logger.warning("⚠️ OIDC response is not valid JSON")
+        except requests.RequestException as e:
+            # 伝播中は4xx/5xxが返るため、失敗として扱わずに再試行
+            logger.info("⏳ Attempt %d: %s", attempt, e)
         
-        remaining = max_wait - (time.time() - start_time)
-        if remaining > interval:
-            logger.info(f"⏳ Waiting {interval}s... ({remaining:.0f}s remaining)")
-            time.sleep(interval)
-            attempt += 1
-        else:
+        remaining = max_wait - (time.monotonic() - start_time)
+        if remaining <= 0:
             break
+        delay = min(max_interval, 2 ** (attempt - 1), remaining)
+        logger.info("⏳ Waiting %.0fs... (%.0fs remaining)", delay, remaining)
+        time.sleep(delay)
+        attempt += 1
     
-    logger.warning(f"❌ OIDC endpoint not available after {max_wait}s")
-    return False
+    logger.warning("❌ OIDC endpoint not available after %ss", max_wait)
+    return None
 
 
 def main():
@@ -236,16 +324,25 @@ def main():
         logger.warning("Please deploy Runtime before setting Identity.")
         return None
     
+    config = None
     try:
         config = setup_oauth2_credential_provider(force=args.force)
     except Exception as e:
         logger.warning("❌ Setup Credential Provider failed:")
         logger.exception(e)
 
-    if config and "runtime" not in config:
+    # Runtime URLが保存済みであれば作成処理全体を省略
+    if config and not config.get("runtime", {}).get("url"):
         logger.info("Creating Runtime with Identity...")
+        import yaml
+        try:
+            # libyamlが利用可能な場合はCベースの高速なローダーを使用
+            from yaml import CSafeLoader as YAMLLoader
+        except ImportError:
+            from yaml import SafeLoader as YAMLLoader
+
         with runtime_path.open() as f:
-            runtime_config = yaml.safe_load(f) or {}
+            runtime_config = yaml.load(f, Loader=YAMLLoader) or {}
 
         agent_name = runtime_config.get("default_agent")
         secure_agent_name = f'{agent_name}_with_identity'
@@ -261,7 +358,7 @@ def main():
             }
         }
 
-        deploy_client = boto3.client('bedrock-agentcore-control', region_name=region)
+        deploy_client = _client('bedrock-agentcore-control', region)
         response = deploy_client.create_agent_runtime(
             agentRuntimeName=secure_agent_name,
             agentRuntimeArtifact={
@@ -278,18 +375,19 @@ def main():
         runtime_id = response['agentRuntimeId']
         runtime_arn = response['agentRuntimeArn']
         # https://docs.aws.amazon.com/ja_jp/bedrock-agentcore/latest/devguide/runtime-mcp.html
-        escaped_arn = urllib.parse.quote(runtime_arn, safe='')
+        # ARNはASCIIのみのため、文字列のエンコード処理を経由せずバイト列を直接エスケープ
+        escaped_arn = quote_from_bytes(runtime_arn.encode('ascii'), safe=b'')
         url = f"https://bedrock-agentcore.{region}.amazonaws.com/runtimes/{escaped_arn}/invocations?qualifier=DEFAULT"
-        save_config({
-            "runtime": {
+        with ConfigStore() as store:
+            store.data["runtime"] = {
                 "id": runtime_id,
                 "name": secure_agent_name,
                 "url": url
             }
-        })
+            config = store.data
         logger.info("✅ Runtime configuration saved")
 
-    console.print_json(json.dumps(load_config()))
+    console.print_json(json.dumps(config or {}))
     console.print(Panel("uv run python test_identity_agent.py", title="Let's test agent with identity!"))
 
 
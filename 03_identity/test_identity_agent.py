@@ -7,6 +7,7 @@ cost_estimator_agent_with_identityを呼び出してAgentCore Identityをテス
 """
 
 import json
+import atexit
 import base64
 import logging
 import argparse
@@ -14,6 +15,8 @@ import asyncio
 from pathlib import Path
 from datetime import datetime, timezone
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from strands import Agent
 from strands import tool
 from bedrock_agentcore.identity.auth import requires_access_token
@@ -27,44 +30,69 @@ logger = logging.getLogger(__name__)
 
 
 CONFIG_FILE = Path("inbound_authorizer.json")
-OAUTH_PROVIDER = ""
-OAUTH_SCOPE = ""
-RUNTIME_URL = ""
-with CONFIG_FILE.open('r') as f:
-    config = json.load(f)
-    OAUTH_PROVIDER = config["provider"]["name"]
-    OAUTH_SCOPE = config["cognito"]["scope"]
-    RUNTIME_URL = config["runtime"]["url"]
-
-
-@tool(name="cost_estimator_tool", description="アーキテクチャの説明からAWSのコストを見積もる")
-@requires_access_token(
-    provider_name= OAUTH_PROVIDER,
-    scopes= [OAUTH_SCOPE],
-    auth_flow= "M2M",
-    force_authentication= False)
-async def cost_estimator_tool(architecture_description, access_token: str) -> str:
-    session_id = f"runtime-with-identity-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}"
-    if access_token:
-        logger.info("✅ Successfully load the access token from AgentCore Identity!")
-        for element in access_token.split("."):
-            logger.info(f"\t{json.loads(base64.b64decode(element).decode())}")
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-        "X-Amzn-Bedrock-AgentCore-Runtime-Session-Id": session_id,
-        "X-Amzn-Trace-Id": session_id,
-    }
-
-    response = requests.post(
-        RUNTIME_URL,
-        headers=headers,
-        data=json.dumps({"prompt": architecture_description})
-    )
 
-    response.raise_for_status()
-    return response.text
+# HTTP接続を呼び出し間で再利用（TLSハンドシェイクを毎回行わない）し、一時的なゲートウェイエラーは再試行
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+))
+atexit.register(_HTTP_SESSION.close)
+
+
+def _decode_jwt_segment(segment: str) -> dict:
+    """JWTのセグメント（パディングなしのbase64url）をデコード"""
+    return json.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+
+
+def create_cost_estimator_tool(config: dict):
+    """
+    設定からAgentCore Identityのアクセストークン付きコスト見積もりツールを作成
+
+    設定ファイルの読み込みとデコレーターの解決をインポート時ではなく実行時に行うため、関数内で構築する
+    """
+    runtime_url = config["runtime"]["url"]
+
+    @tool(name="cost_estimator_tool", description="アーキテクチャの説明からAWSのコストを見積もる")
+    @requires_access_token(
+        provider_name= config["provider"]["name"],
+        scopes= [config["cognito"]["scope"]],
+        auth_flow= "M2M",
+        force_authentication= False)
+    async def cost_estimator_tool(architecture_description, access_token: str) -> str:
+        session_id = f"runtime-with-identity-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}"
+        if access_token:
+            logger.info("✅ Successfully load the access token from AgentCore Identity!")
+            # デコードはINFOログが有効な場合のみ実行（ヘッダーとペイロードのみJSONで、署名は対象外）
+            if logger.isEnabledFor(logging.INFO):
+                # 署名部分は分割もデコードもしない（3分割でないトークンでも例外にしない）
+                for element in access_token.split(".", 2)[:2]:
+                    logger.info("\t%s", _decode_jwt_segment(element))
+
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+            "X-Amzn-Bedrock-AgentCore-Runtime-Session-Id": session_id,
+            "X-Amzn-Trace-Id": session_id,
+        }
+
+        def invoke_runtime() -> str:
+            # 本文全体をバッファしてから一括デコードせず、受信したチャンクを逐次デコード
+            with _HTTP_SESSION.post(
+                runtime_url,
+                headers=headers,
+                data=json.dumps({"prompt": architecture_description}),
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                response.encoding = response.encoding or "utf-8"
+                return "".join(response.iter_content(chunk_size=None, decode_unicode=True))
+
+        # 同期HTTP呼び出しでイベントループをブロックしないよう、ワーカースレッドで実行
+        return await asyncio.to_thread(invoke_runtime)
+
+    return cost_estimator_tool
 
 
 async def main():
@@ -79,6 +107,9 @@ async def main():
     )
     args = parser.parse_args()
 
+    config = json.loads(CONFIG_FILE.read_bytes())
+    cost_estimator_tool = create_cost_estimator_tool(config)
+
     agent = Agent(
         system_prompt=(
             "あなたはプロのソリューション アーキテクトです。"
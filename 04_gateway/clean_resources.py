@@ -1,5 +1,6 @@
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import boto3
 
@@ -17,22 +18,33 @@ def clean_resources():
     gateway_id = config["gateway"]["id"]
 
     print(f"Deleting all targets for gateway {gateway_id}.")
-    list_response = gateway_client.list_gateway_targets(
-        gatewayIdentifier=gateway_id,
-        maxResults=100
-    )
-    for item in list_response['items']:
-        target_id = item["targetId"]
+    # 100件を超えるターゲットも削除できるようにページネーターで全件を取得
+    paginator = gateway_client.get_paginator('list_gateway_targets')
+    target_ids = [
+        item["targetId"]
+        for page in paginator.paginate(gatewayIdentifier=gateway_id)
+        for item in page['items']
+    ]
+
+    def delete_target(target_id):
         print(f"Deleting target {target_id}.")
         gateway_client.delete_gateway_target(
             gatewayIdentifier=gateway_id,
             targetId=target_id
         )
+
+    # ターゲットは互いに独立しているため並列に削除（boto3クライアントはスレッドセーフ）
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(delete_target, target_id) for target_id in target_ids]
+        for future in as_completed(futures):
+            future.result()
+
     print(f"Deleting gateway {gateway_id}.")
     gateway_client.delete_gateway(gatewayIdentifier=gateway_id)
 
     os.remove(".agentcore.json")
     os.remove("outbound_gateway.json")
+    Path(".token_cache.json").unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
@@ -2,15 +2,16 @@
 AgentCore SDKを使用してLambdaターゲットを持つAgentCore Gatewayを作成
 """
 
+import os
 import json
+import hashlib
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from botocore.config import Config
 from pathlib import Path
 from typing import Optional
-from rich.console import Console
-from rich.panel import Panel
-from bedrock_agentcore_starter_toolkit.operations.gateway.client import GatewayClient
 
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
@@ -19,6 +20,16 @@ logger = logging.getLogger(__name__)
 PROVIDER_NAME = "outbound-identity-for-cost-estimator-agent"
 IDENTITY_FILE = Path("../03_identity/inbound_authorizer.json")
 CONFIG_FILE = Path("outbound_gateway.json")
+# コントロールプレーン呼び出し用の接続設定（キープアライブで接続を再利用し、スロットリングにはアダプティブリトライで対応）
+_BOTO_CONFIG = Config(
+    max_pool_connections=16,
+    tcp_keepalive=True,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    connect_timeout=3,
+    read_timeout=10
+)
+# 読み込み済みの設定（ファイルの更新日時・サイズが変わった場合のみ再読み込み）
+_CONFIG_CACHE = {"key": None, "data": None}
 
 
 def setup_gateway(provider_name: str = PROVIDER_NAME, force: bool = False) -> dict:
@@ -39,22 +50,28 @@ def setup_gateway(provider_name: str = PROVIDER_NAME, force: bool = False) -> di
     """
 
     config = load_config()
-    region = boto3.Session().region_name
 
     has_provider = config and 'provider' in config
     has_gateway = config and 'gateway' in config
 
-    control_client = boto3.client('bedrock-agentcore-control', region_name=region)
-    gateway_client = GatewayClient(region_name=region)
-    
-    # すべてが完了しており、強制しない場合は、概要を表示して終了
+    # すべてが完了しており、強制しない場合は、概要を表示して終了（クライアントを作成する前に判定）
     if config and has_provider and has_gateway and not force:
         logger.info("All components already configured (use --force to recreate)")
         return config
-    elif config:
+
+    # 認証情報と設定の解決を一度だけ行うため、単一のセッションからクライアントを作成
+    session = boto3.Session()
+    region = session.region_name
+
+    control_client = session.client('bedrock-agentcore-control', region_name=region, config=_BOTO_CONFIG)
+    # starter toolkitは読み込みが重いため、使用時にインポート
+    from bedrock_agentcore_starter_toolkit.operations.gateway.client import GatewayClient
+    gateway_client = GatewayClient(region_name=region)
+    
+    if config:
         if has_gateway and force:
             logger.info("Delete existing Gateway...")
-            delete_gateway(gateway_client, config)
+            delete_gateway(control_client, config['gateway'])
             has_gateway = False
     
     if not has_gateway:
@@ -62,8 +79,7 @@ def setup_gateway(provider_name: str = PROVIDER_NAME, force: bool = False) -> di
 
         logger.info("Loading identity configuration from file...")
         if IDENTITY_FILE.exists():
-            with open(IDENTITY_FILE) as f:
-                identity_config = json.load(f)
+            identity_config = json.loads(IDENTITY_FILE.read_bytes())
         else:
             raise FileNotFoundError("Identity configuration file not found")
 
@@ -100,7 +116,7 @@ def setup_gateway(provider_name: str = PROVIDER_NAME, force: bool = False) -> di
                         },
                         "email_address": {
                             "type": "string",
-                            "description": "Recipient email address"
+                            "description": "Recipient email address (comma-separated for multiple recipients)"
                         },
                         "subject": {
                             "type": "string",
@@ -120,6 +136,8 @@ def setup_gateway(provider_name: str = PROVIDER_NAME, force: bool = False) -> di
         create_request = {
             "gatewayIdentifier": gateway_id,
             "name": target_name,
+            # 同一Gateway・同一ターゲット名のリクエストは再試行時にサーバー側で重複排除される
+            "clientToken": hashlib.sha256(f"{gateway_id}:{target_name}".encode()).hexdigest(),
             "targetConfiguration": {
                 "mcp": {
                     "lambda": {
@@ -135,60 +153,89 @@ def setup_gateway(provider_name: str = PROVIDER_NAME, force: bool = False) -> di
 
         target_response = control_client.create_gateway_target(**create_request)            
         target_id = target_response["targetId"]
-        # 作成直後にgateway設定を保存
+        # 作成直後にgateway設定を保存（保持している設定を更新して書き込み、再読み込みはしない）
         save_config({
             "gateway": {
                 "id": gateway_id,
                 "url": gateway_url,
                 "target_id": target_id
             }
-        })
+        }, base=config)
         logger.info("✅ Gateway configuration saved")            
         logger.info("✅ Gateway setup complete!")
         logger.info("Next step: Run 'uv run python test_gateway.py' to test the Gateway")
     
-    config = load_config()
     return config
 
 
-def delete_gateway(client, config):
-    """既存のGatewayリソースをクリーンアップ"""
-    # まずターゲットを削除
-    if 'target_id' in config and 'id' in config:
-        client.delete_mcp_gateway_target(config['id'], config['target_id'])
-        logger.info("Deleted Gateway target")
+def delete_gateway(client, gateway_config):
+    """
+    既存のGatewayリソースをクリーンアップ
+
+    並列削除時のスロットリングにアダプティブリトライで対応するため、
+    _BOTO_CONFIGで作成したbedrock-agentcore-controlクライアントを受け取る
+    """
+    gateway_id = gateway_config.get('id')
+    if not gateway_id:
+        return
+
+    # まずターゲットを削除（複数ある場合は並列に削除）
+    target_ids = gateway_config.get('target_ids') or [
+        target_id for target_id in [gateway_config.get('target_id')] if target_id
+    ]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [
+            executor.submit(client.delete_gateway_target, gatewayIdentifier=gateway_id, targetId=target_id)
+            for target_id in target_ids
+        ]
+        for future in as_completed(futures):
+            future.result()
+            logger.info("Deleted Gateway target")
     
-    # Gatewayを削除
-    if 'id' in config:
-        client.delete_mcp_gateway(config['id'])
-        logger.info("Deleted Gateway")
+    # すべてのターゲットの削除後にGatewayを削除
+    client.delete_gateway(gatewayIdentifier=gateway_id)
+    logger.info("Deleted Gateway")
+
+
+def _config_file_key(stat_result) -> tuple:
+    """設定ファイルの変更検知に使うキー（更新日時とサイズ）"""
+    return (stat_result.st_mtime_ns, stat_result.st_size)
 
 
 def load_config():
-    """ファイルから設定を読み込み"""
-    config = {}
-    with CONFIG_FILE.open('r') as f:
-        config = json.load(f)
-    return config
+    """ファイルから設定を読み込み（ファイルが変更されていなければキャッシュ済みの設定を返す）"""
+    key = _config_file_key(CONFIG_FILE.stat())
+    if _CONFIG_CACHE["key"] != key:
+        _CONFIG_CACHE["data"] = json.loads(CONFIG_FILE.read_bytes())
+        _CONFIG_CACHE["key"] = key
+    return _CONFIG_CACHE["data"]
 
 
-def save_config(updates: Optional[dict]=None, delete_key: str=""):
-    """新しいデータで設定ファイルを更新"""
-    config = load_config()
+def save_config(updates: Optional[dict]=None, delete_key: str="", *, base: Optional[dict]=None):
+    """新しいデータで設定ファイルを更新（baseが指定された場合はファイルを読み直さずにその設定を更新）"""
+    config = load_config() if base is None else base
     
     if updates is not None:
         config.update(updates)
     elif delete_key:
         del config[delete_key]
     
-    with CONFIG_FILE.open('w') as f:
-        json.dump(config, f, indent=2)
+    # 一時ファイルに書き込んでから置き換え、中断されても読み込み側が壊れたファイルを見ないようにする
+    tmp_file = CONFIG_FILE.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps(config, indent=2), encoding='utf-8')
+    os.replace(tmp_file, CONFIG_FILE)
+    # 書き込んだ内容でキャッシュを更新し、次回の読み込みで再パースしない
+    _CONFIG_CACHE["data"] = config
+    _CONFIG_CACHE["key"] = _config_file_key(CONFIG_FILE.stat())
 
 
 def main():
     parser = argparse.ArgumentParser(description='Create AgentCore Gateway')
     parser.add_argument('--force', action='store_true', help='Force recreation of resources')
     args = parser.parse_args()
+    # richは出力時にのみ必要なため、引数の解析後にインポート
+    from rich.console import Console
+    from rich.panel import Panel
     console = Console()
     
     try:
@@ -8,14 +8,75 @@ HTMLに変換して、Amazon SESを使用してHTMLメールとして送信し
 import json
 import logging
 import os
+import re
+from email.message import EmailMessage
+from email.policy import SMTP
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-import markdown
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # ログ設定
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
+# SESクライアントはウォームスタート時に再利用されるようモジュールレベルで一度だけ初期化
+# （キープアライブによりHTTPS接続も呼び出し間で再利用）
+_SES = boto3.client('ses', config=Config(
+    tcp_keepalive=True,
+    retries={'mode': 'standard', 'max_attempts': 3},
+    connect_timeout=3,
+    read_timeout=10
+))
+
+# 複数宛先へ並列に送信する際の最大同時実行数
+SEND_MAX_WORKERS = 8
+
+# プレーンテキストパートを含めるかどうか（無効時はHTMLパートのみを送信してペイロードを削減）
+INCLUDE_TEXT_PART = os.environ.get('INCLUDE_TEXT_PART', '1') == '1'
+
+# プレーンテキスト版で取り除くMarkdown記法（順に適用）
+# - 行頭の見出し・引用記号と箇条書きの記号
+# - 強調（**太字**・*斜体*）は記号のみ取り除いて中身を残す
+# - コード記号
+# 計算式の「0.0416 * 730」のように前後に空白がある単独の*は強調ではないため残す。
+# アンダースコアは識別子などの一部であることが多いため残す
+_MARKDOWN_PLAIN_TEXT_RULES = (
+    (re.compile(r'^[ \t]*[#>]+[ \t]*|^[ \t]*[*-][ \t]+', re.MULTILINE), ''),
+    (re.compile(r'\*\*(\S(?:.*?\S)?)\*\*'), r'\1'),
+    (re.compile(r'(?<![\w*])\*(\S(?:.*?\S)?)\*(?!\*)'), r'\1'),
+    (re.compile(r'`+'), ''),
+)
+
+# ツールごとの必須パラメータ（ツール名の確認とパラメータの検証を1回の辞書引きで行う）
+_REQUIRED_PARAMS = {
+    'markdown_to_email': ('markdown_text', 'email_address'),
+}
+
+# Markdownコンバーター（初回の変換時に構築）
+_MD = None
+
+
+def _markdown_converter():
+    """
+    Markdownコンバーターを取得
+
+    markdownモジュールの読み込みと拡張機能の登録はコールドスタートを遅くするため初回使用時まで遅延し、
+    構築したコンバーターは以降の呼び出しでreset()して再利用する
+    """
+    global _MD
+    if _MD is None:
+        import markdown
+        _MD = markdown.Markdown(extensions=['tables', 'nl2br'])
+    return _MD.reset()
+
+
+def _markdown_to_text(markdown_text):
+    """メールのプレーンテキストパート用にMarkdown記法を取り除く"""
+    for pattern, replacement in _MARKDOWN_PLAIN_TEXT_RULES:
+        markdown_text = pattern.sub(replacement, markdown_text)
+    return markdown_text
+
 
 def lambda_handler(event, context):
     """
@@ -37,11 +98,14 @@ def lambda_handler(event, context):
     """
     try:
         # 受信リクエストをログ出力
-        logger.info(f"Received event: {json.dumps(event)}")
+        # INFOログが無効な場合はイベントのシリアライズ自体を省略
+        # （区切りの空白を省き、日本語をエスケープせずにシリアライズして出力サイズを削減）
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Received event: %s", json.dumps(event, ensure_ascii=False, separators=(',', ':')))
         
         # コンテキストからツール名を抽出
         if context and context.client_context:
-            logger.info(f"Context: {context.client_context}")
+            logger.info("Context: %s", context.client_context)
             tool_name = context.client_context.custom.get('bedrockAgentCoreToolName', '')
             
             # Gatewayによって追加されたプレフィックスを削除（形式: targetName___toolName）
@@ -52,30 +116,26 @@ def lambda_handler(event, context):
 
         logger.info(f"Processing tool: {tool_name}")
         
-        # これがmarkdown_to_emailツールであることを確認
-        if tool_name != 'markdown_to_email':
+        # 既知のツールであることを確認し、必須パラメータを一括で検証
+        required_params = _REQUIRED_PARAMS.get(tool_name)
+        if required_params is None:
             return {
                 'statusCode': 400,
                 'body': f"Unknown tool: {tool_name}"
             }
-        
-        # イベントから必要なパラメータを取得
-        markdown_text = event.get('markdown_text', '')
-        email_address = event.get('email_address', '')
-        subject = event.get('subject', 'AWS Cost Estimation Result')
-        
-        if not markdown_text:
-            return {
-                'statusCode': 400,
-                'body': "Missing required parameter: markdown_text"
-            }
-        
-        if not email_address:
+
+        missing = next((name for name in required_params if not event.get(name)), None)
+        if missing:
             return {
                 'statusCode': 400,
-                'body': "Missing required parameter: email_address"
+                'body': f"Missing required parameter: {missing}"
             }
 
+        # イベントから必要なパラメータを取得
+        markdown_text = event['markdown_text']
+        email_address = event['email_address']
+        subject = event.get('subject', 'AWS Cost Estimation Result')
+
         # MarkdownをHTMLに変換してメールを送信
         result = convert_and_send_email(markdown_text, email_address, subject)
 
@@ -107,48 +167,35 @@ def convert_and_send_email(markdown_text, email_address, subject):
     try:
         # テーブルサポート付きでMarkdownをHTMLに変換
         logger.info("Converting markdown to HTML")
-        html_content = markdown.markdown(
-            markdown_text,
-            extensions=['tables', 'nl2br']
-        )
+        html_content = _markdown_converter().convert(markdown_text)
         
         # 環境変数から送信者メールアドレスを取得
         sender_email = os.environ.get('SES_SENDER_EMAIL')
         if not sender_email:
             raise ValueError("SES_SENDER_EMAIL environment variable not set")
         
-        # SESクライアントを初期化
-        ses_client = boto3.client('ses')
-        
-        # SES経由でメールを送信
-        logger.info(f"Sending email to: {email_address}")
-        response = ses_client.send_email(
-            Source=sender_email,
-            Destination={
-                'ToAddresses': [email_address]
-            },
-            Message={
-                'Subject': {
-                    'Data': subject,
-                    'Charset': 'UTF-8'
-                },
-                'Body': {
-                    'Html': {
-                        'Data': html_content,
-                        'Charset': 'UTF-8'
-                    },
-                    'Text': {
-                        'Data': markdown_text,  # プレーンテキスト版を含める
-                        'Charset': 'UTF-8'
-                    }
-                }
-            }
-        )
+        # 宛先はカンマ区切りで複数指定可能（宛先ごとに個別のメールを送信）
+        recipients = [address.strip() for address in email_address.split(',') if address.strip()]
+        if not recipients:
+            raise ValueError("No valid recipient email address")
 
-        message_id = response['MessageId']
-        logger.info(f"Email sent successfully. Message ID: {message_id}")
+        # Markdown記法を取り除いたプレーンテキスト版（無効時はHTMLパートのみ）
+        text_content = _markdown_to_text(markdown_text) if INCLUDE_TEXT_PART else None
+
+        # SES経由でメールを送信（複数宛先の場合はスレッドセーフな共有クライアントで並列に送信）
+        logger.info(f"Sending email to: {', '.join(recipients)}")
+        if len(recipients) == 1:
+            message_ids = [_send_email(sender_email, recipients[0], subject, html_content, text_content)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(SEND_MAX_WORKERS, len(recipients))) as executor:
+                message_ids = list(executor.map(
+                    lambda recipient: _send_email(sender_email, recipient, subject, html_content, text_content),
+                    recipients
+                ))
 
-        return f"Email sent successfully to {email_address}. Message ID: {message_id}"
+        logger.info(f"Email sent successfully. Message ID: {', '.join(message_ids)}")
+
+        return f"Email sent successfully to {', '.join(recipients)}. Message ID: {', '.join(message_ids)}"
         
     except ClientError as e:
         error_code = e.response['Error']['Code']
@@ -167,3 +214,35 @@ def convert_and_send_email(markdown_text, email_address, subject):
     except Exception as e:
         logger.exception(f"Unexpected error sending email: {e}")
         raise Exception(f"Failed to send email: {str(e)}")
+
+
+def _build_message(sender_email, recipient, subject, html_content, text_content):
+    """
+    送信するMIMEメッセージを組み立て
+
+    テキストパートがある場合はmultipart/alternative、ない場合はHTMLのみの単一パートとし、
+    件名のエンコードと境界文字列の生成はemailパッケージに任せる
+    """
+    message = EmailMessage(policy=SMTP)
+    message['Subject'] = subject
+    message['From'] = sender_email
+    message['To'] = recipient
+    # 本文は7bitで安全に送れるようbase64でエンコード（日本語や長い行を含むため）
+    if text_content is None:
+        message.set_content(html_content, subtype='html', cte='base64')
+    else:
+        message.set_content(text_content, cte='base64')
+        message.add_alternative(html_content, subtype='html', cte='base64')
+    return message.as_bytes()
+
+
+def _send_email(sender_email, recipient, subject, html_content, text_content):
+    """単一の宛先へSES経由でメールを送信し、メッセージIDを返す"""
+    response = _SES.send_raw_email(
+        Source=sender_email,
+        Destinations=[recipient],
+        RawMessage={
+            'Data': _build_message(sender_email, recipient, subject, html_content, text_content)
+        }
+    )
+    return response['MessageId']
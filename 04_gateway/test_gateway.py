@@ -10,11 +10,18 @@ aws_cost_estimationツールを呼び出してAgentCore Gatewayをテスト
 import json
 import os
 import sys
+import time
+import base64
+import contextlib
+import functools
+import itertools
 import logging
+import threading
 import argparse
 import asyncio
+import atexit
 from pathlib import Path
-import boto3
+import httpx
 from strands import Agent
 from strands import tool
 from strands.tools.mcp import MCPClient
@@ -34,63 +41,235 @@ from cost_estimator_agent.cost_estimator_agent import AWSCostEstimatorAgent  # n
 
 IDENTITY_CONFIG_FILE = Path("../03_identity/inbound_authorizer.json")
 GATEWAY_CONFIG_FILE = Path("outbound_gateway.json")
-OAUTH_PROVIDER = ""
-OAUTH_SCOPE = ""
-GATEWAY_URL = ""
-with IDENTITY_CONFIG_FILE.open('r') as f:
-    config = json.load(f)
-    OAUTH_PROVIDER = config["provider"]["name"]
-    OAUTH_SCOPE = config["cognito"]["scope"]
+TOKEN_CACHE_FILE = Path(".token_cache.json")
+TOKEN_EXPIRY_MARGIN = 60  # 有効期限の直前に失効しないよう余裕を持たせる秒数
+DEFAULT_TOKEN_LIFETIME = 3300  # expクレームを読めない場合の有効期間（Cognitoの1時間のトークンを想定）
+# プロセス内のアクセストークンキャッシュ（(プロバイダー名, スコープ) -> (トークン, time.monotonic()基準の有効期限)）
+_TOKEN_CACHE = {}
+_TOKEN_LOCK = threading.Lock()
 
-with GATEWAY_CONFIG_FILE.open('r') as f:
-    config = json.load(f)
-    GATEWAY_URL = config["gateway"]["url"]
+
+@functools.lru_cache(maxsize=1)
+def _identity_config() -> dict:
+    """03_identityの設定を読み込み（初回のみファイルを読み込む）"""
+    return json.loads(IDENTITY_CONFIG_FILE.read_bytes())
+
+
+@functools.lru_cache(maxsize=1)
+def _gateway_config() -> dict:
+    """Gatewayの設定を読み込み（初回のみファイルを読み込む）"""
+    return json.loads(GATEWAY_CONFIG_FILE.read_bytes())
+
+
+def _oauth_settings() -> tuple:
+    """OAuthプロバイダー名とスコープを取得"""
+    config = _identity_config()
+    return config["provider"]["name"], config["cognito"]["scope"]
+
+
+@functools.lru_cache(maxsize=4)
+def _cost_estimator(region: str = "") -> AWSCostEstimatorAgent:
+    """リージョンごとにコスト見積もりエージェントを一度だけ作成（未指定時はキャッシュ済みセッションのリージョン）"""
+    return AWSCostEstimatorAgent(region=region)
 
 
 @tool(name="cost_estimator_tool", description="アーキテクチャの説明からAWSのコストを見積もる")
 def cost_estimator_tool(architecture_description: str) -> str:
-    region = boto3.Session().region_name
-    cost_estimator = AWSCostEstimatorAgent(region=region)
+    cost_estimator = _cost_estimator()
     logger.info(f"We will estimate about {architecture_description}")
     result = cost_estimator.estimate_costs(architecture_description)
     return result
 
-@requires_access_token(
-    provider_name= OAUTH_PROVIDER,
-    scopes= [OAUTH_SCOPE],
-    auth_flow= "M2M",
-    force_authentication= False)
+@functools.lru_cache(maxsize=2)
+def _access_token_getter(force_authentication: bool = False):
+    """設定されたOAuthプロバイダーからアクセストークンを取得する関数を作成"""
+    provider_name, scope = _oauth_settings()
+
+    @requires_access_token(
+        provider_name= provider_name,
+        scopes= [scope],
+        auth_flow= "M2M",
+        force_authentication= force_authentication)
+    async def get_access_token(access_token):
+        """アクセストークンを取得するヘルパー関数"""
+        if access_token:
+            logger.info("✅ Successfully loaded the access token!")
+        return access_token
+
+    return get_access_token
+
+@functools.lru_cache(maxsize=1)
+def _token_loop() -> asyncio.AbstractEventLoop:
+    """
+    アクセストークン取得用の永続イベントループ（取得のたびにループを作り直さない）
+
+    バックグラウンドスレッドで動かし続けるため、呼び出し元でイベントループが動作中でも使用できる
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="token-loop", daemon=True).start()
+    atexit.register(loop.call_soon_threadsafe, loop.stop)
+    return loop
+
+
+def _run_on_token_loop(coro):
+    """コルーチンを永続イベントループで実行し、結果を待つ"""
+    return asyncio.run_coroutine_threadsafe(coro, _token_loop()).result()
+
+
+def _decode_jwt_segment(segment: str) -> dict:
+    """JWTのセグメント（パディングなしのbase64url）をデコード"""
+    return json.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+
+
+def _load_cached_token():
+    """有効期限内のキャッシュ済みアクセストークンを読み込み（使えない場合はNone）"""
+    try:
+        cache = json.loads(TOKEN_CACHE_FILE.read_bytes())
+    except (OSError, ValueError):
+        return None
+    if (cache.get("provider"), cache.get("scope")) != _oauth_settings():
+        return None
+    if time.time() >= cache.get("exp", 0) - TOKEN_EXPIRY_MARGIN:
+        return None
+    return cache.get("token")
+
+
+def _token_exp(access_token):
+    """JWTのexpクレームを取得（署名はローカルでは検証しない。取得できない場合はNone）"""
+    try:
+        return _decode_jwt_segment(access_token.split(".", 2)[1])["exp"]
+    except (IndexError, KeyError, ValueError):
+        return None
+
+
+def _save_cached_token(access_token):
+    """アクセストークンをJWTのexpクレームと共にファイルへキャッシュ"""
+    exp = _token_exp(access_token)
+    if exp is None:
+        return
+    provider_name, scope = _oauth_settings()
+    cache = {"provider": provider_name, "scope": scope, "token": access_token, "exp": exp}
+    # トークンを含むため所有者のみ読み書き可能なファイルとして作成
+    fd = os.open(TOKEN_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f)
+
+
+def get_cached_access_token(force_refresh: bool = False) -> str:
+    """
+    アクセストークンを取得（プロセス内、次にファイルのキャッシュを確認し、期限切れの場合のみ取得）
+
+    Args:
+        force_refresh: キャッシュを使わずに再認証して取得するかどうか
+    """
+    key = _oauth_settings()
+    with _TOKEN_LOCK:
+        if not force_refresh:
+            cached = _TOKEN_CACHE.get(key)
+            if cached and time.monotonic() < cached[1] - TOKEN_EXPIRY_MARGIN:
+                return cached[0]
+            access_token = _load_cached_token()
+            if access_token:
+                logger.info("✅ Reusing the cached access token")
+        else:
+            access_token = None
+        if not access_token:
+            access_token = _run_on_token_loop(_access_token_getter(force_refresh)())
+            _save_cached_token(access_token)
+
+        exp = _token_exp(access_token)
+        lifetime = exp - time.time() if exp is not None else DEFAULT_TOKEN_LIFETIME
+        _TOKEN_CACHE[key] = (access_token, time.monotonic() + lifetime)
+        return access_token
+
+
+def invalidate_access_token():
+    """キャッシュ済みのアクセストークンを破棄（Gatewayに拒否された場合）"""
+    with _TOKEN_LOCK:
+        _TOKEN_CACHE.pop(_oauth_settings(), None)
+        TOKEN_CACHE_FILE.unlink(missing_ok=True)
+
+
+def _is_unauthorized(error: BaseException) -> bool:
+    """例外（原因となった例外や例外グループを含む）がHTTP 401によるものかを判定"""
+    pending, seen = [error], set()
+    while pending:
+        current = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, httpx.HTTPStatusError) and current.response.status_code == 401:
+            return True
+        pending.extend(getattr(current, "exceptions", ()))
+        pending.extend((current.__cause__, current.__context__))
+    return False
+
+
+def _create_http_client(headers=None, timeout=None, auth=None):
+    """
+    キープアライブ接続を保持するMCP用HTTPクライアントを作成
+
+    ツール一覧のページングとエージェントによるツール呼び出しで同じ接続を再利用し、
+    リクエストごとのTCP/TLSハンドシェイクを避ける
+    """
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout or httpx.Timeout(30.0),
+        auth=auth,
+        follow_redirects=True,
+        limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=30),
+    )
+
+
+def _create_transport(access_token):
+    """HTTPクライアントを直接返すトランスポートを作成"""
+    return streamablehttp_client(
+        _gateway_config()["gateway"]["url"],
+        headers={"Authorization": f"Bearer {access_token}"},
+        httpx_client_factory=_create_http_client
+    )
+
+
+@contextlib.contextmanager
+def _mcp_session():
+    """
+    GatewayとのMCPセッションを開始
+
+    キャッシュ済みのアクセストークンが拒否された（401）場合は、キャッシュを破棄して再認証し一度だけ再接続する
+    """
+    for attempt in (1, 2):
+        access_token = get_cached_access_token(force_refresh=attempt > 1)
+        mcp_client = MCPClient(functools.partial(_create_transport, access_token))
+        try:
+            mcp_client.start()
+            break
+        except Exception as e:
+            if attempt > 1 or not _is_unauthorized(e):
+                raise
+            logger.warning("⚠️ The cached access token was rejected, re-authenticating...")
+            invalidate_access_token()
+    try:
+        yield mcp_client
+    finally:
+        mcp_client.stop(None, None, None)
 
-async def get_access_token(access_token):
-    """アクセストークンを取得するヘルパー関数"""
-    if access_token:
-        logger.info("✅ Successfully loaded the access token!")
-    return access_token
 
 def estimate_and_send(architecture_description, address):
     logger.info("Testing Gateway with MCP client (Strands Agents)...")
-    # まずアクセストークンを取得
-    access_token = asyncio.run(get_access_token())
-    # HTTPクライアントを直接返すトランスポート呼び出し可能関数を作成
-    def create_transport():
-        return streamablehttp_client(
-            GATEWAY_URL,
-            headers={"Authorization": f"Bearer {access_token}"}
-        )
-    mcp_client = MCPClient(create_transport)
     logger.info("Prepare agent's tools...")
-    tools = [cost_estimator_tool]
-    with mcp_client:
-        more_tools = True
+    with _mcp_session() as mcp_client:
+        # 全ページを集めてから一度だけ展開してツール一覧を構築
+        # 次ページの要求には前ページのpagination_tokenが必要なため、ページの取得は先読みできず逐次となる
+        # （ページ取得以外の処理はページ数に依存しない1回の展開のみ）
+        pages = []
         pagination_token = None
-        while more_tools:
-            tmp_tools = mcp_client.list_tools_sync(pagination_token=pagination_token)
-            tools.extend(tmp_tools)
-            if tmp_tools.pagination_token is None:
-                more_tools = False
-            else:
-                more_tools = True 
-                pagination_token = tmp_tools.pagination_token
+        while True:
+            page = mcp_client.list_tools_sync(pagination_token=pagination_token)
+            pages.append(page)
+            if page.pagination_token is None:
+                break
+            pagination_token = page.pagination_token
+        tools = [cost_estimator_tool, *itertools.chain.from_iterable(pages)]
 
         _names = [tool.tool_name for tool in tools]
         logger.info(f"Found the following tools: {_names}")
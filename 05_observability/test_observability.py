@@ -11,15 +11,28 @@ AgentCore 可観測性テストスクリプト
 
 使用方法:
     python test_observability.py
+    python test_observability.py --parallel  # 同一セッション内のプロンプトを並列に呼び出す
 """
 
 import json
 import logging
+import argparse
 import boto3
 import yaml
+from botocore.config import Config
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+try:
+    # libyamlが利用可能な場合はCベースの高速なローダーを使用
+    from yaml import CSafeLoader as _YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as _YAMLLoader
 
 # ログ設定
 logging.basicConfig(
@@ -28,37 +41,87 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# トレースIDの最大長
+MAX_TRACE_ID_LENGTH = 128
+
+# ストリーミングレスポンスの読み込み単位（バイト）
+STREAM_CHUNK_SIZE = 65536
+
+# 同一セッション内の連続した呼び出しでTLS接続を再利用するための接続設定
+# （スロットリングにはアダプティブリトライで対応し、接続できない場合は早めに失敗させる。
+#   ストリーミング応答は生成に時間がかかるため読み込みタイムアウトは長めに設定）
+_BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=20,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    connect_timeout=2,
+    read_timeout=120
+)
+
+
+@lru_cache(maxsize=1)
+def _session() -> boto3.Session:
+    """認証情報とリージョンの解決を一度だけ行うboto3セッション"""
+    return boto3.Session()
+
+
+@lru_cache(maxsize=4)
+def _agentcore_client(region: str):
+    """リージョンごとに共有するbedrock-agentcoreクライアント"""
+    return _session().client('bedrock-agentcore', region_name=region, config=_BOTO_CONFIG)
+
+
+@dataclass(frozen=True, slots=True)
+class SessionIds:
+    """1つのテストセッションで使うセッションIDとトレースID（生成時に一度だけ計算）"""
+    session_id: str
+    trace_id: str
+
 
 class ObservabilityTester:
     """意味のあるセッション追跡でAgentCoreの可観測性をテスト"""
     
-    def __init__(self, agent_arn: str, region: str = ""):
+    def __init__(self, agent_arn: str, region: str = "", client: Optional[Any] = None):
         self.agent_arn = agent_arn
         self.region = region
         if not self.region:
-            # 指定されていない場合はboto3セッションからデフォルトリージョンを使用
-            self.region = boto3.Session().region_name
-        self.client = boto3.client('bedrock-agentcore', region_name=self.region)
+            # 指定されていない場合はキャッシュ済みboto3セッションからデフォルトリージョンを使用
+            self.region = _session().region_name
+        # 指定されていない場合はリージョンごとの共有クライアントを使用
+        self.client = client or _agentcore_client(self.region)
     
-    def generate_session_id(self, user_id: str) -> str:
-        """最小長要件を満たす意味のあるセッションIDを生成"""
+    def generate_session_id(self, user_id: str) -> SessionIds:
+        """最小長要件を満たす意味のあるセッションIDと、それに対応するトレースIDを生成"""
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         # AgentCoreはセッションIDが最低16文字必要
         session_id = f"{user_id}_{timestamp}_observability_test"
-        logger.info(f"Generated session ID: {session_id} (length: {len(session_id)})")
-        return session_id
+        logger.info("Generated session ID: %s (length: %d)", session_id, len(session_id))
+        # トレースIDが制限内であることを確認（文字単位で切り詰めるためマルチバイト文字も途中で切れない）
+        return SessionIds(session_id=session_id, trace_id=session_id[:MAX_TRACE_ID_LENGTH])
     
-    def invoke_agent(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """エラーハンドリング付きの単一エージェント呼び出し"""
+    def invoke_agent(self, session: SessionIds, payload: Dict[str, Any], collect: bool = True) -> Dict[str, Any]:
+        """
+        エラーハンドリング付きの単一エージェント呼び出し
+
+        Args:
+            session: 呼び出しに使うセッションIDとトレースID
+            payload: エージェントに送るペイロード
+            collect: Falseの場合、レスポンスを読み切るだけで保持しない（結果はNone）
+        """
         try:
             response = self.client.invoke_agent_runtime(
                 agentRuntimeArn=self.agent_arn,
-                runtimeSessionId=session_id,
-                payload=json.dumps(payload).encode('utf-8'),
-                traceId=session_id[:128]  # トレースIDが制限内であることを確認
+                runtimeSessionId=session.session_id,
+                # 日本語をエスケープせず区切りの空白も省いてシリアライズし、ペイロードを縮小
+                payload=json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                traceId=session.trace_id
             )
             
-            result = self._process_response(response)
+            if collect:
+                result = self._process_response(response)
+            else:
+                self._drain_response(response)
+                result = None
             return {
                 'status': 'success',
                 'result': result
@@ -71,9 +134,16 @@ class ObservabilityTester:
                 'error': str(e)
             }
     
-    def test_multiple_invocations_same_session(self, user_id: str) -> Dict[str, Any]:
-        """同一セッション内での複数の呼び出しをテスト"""
-        session_id = self.generate_session_id(user_id)
+    def test_multiple_invocations_same_session(self, user_id: str, parallel: bool = False) -> Dict[str, Any]:
+        """
+        同一セッション内での複数の呼び出しをテスト
+
+        Args:
+            user_id: セッションIDの生成に使うユーザーID
+            parallel: Trueの場合、独立したプロンプトを並列に呼び出す
+                （会話の順序は保証されないため、既定では順番に呼び出す）
+        """
+        session = self.generate_session_id(user_id)
         
         # 複数のテストプロンプトを定義
         test_prompts = [
@@ -83,31 +153,37 @@ class ObservabilityTester:
         ]
         
         logger.info(f"Testing multiple invocations for user: {user_id}")
-        logger.info(f"Session ID: {session_id}")
+        logger.info(f"Session ID: {session.session_id}")
         logger.info(f"Number of invocations: {len(test_prompts)}")
         
-        results = []
-        
-        for i, prompt in enumerate(test_prompts, 1):
+        def invoke(i: int, prompt: str) -> Dict[str, Any]:
             logger.info(f"\n--- Invocation {i}/{len(test_prompts)} ---")
             logger.info(f"Prompt: {prompt}")
             
             payload = {"prompt": prompt}
-            result = self.invoke_agent(session_id, payload)
+            # 呼び出しの成否のみを記録するため、レスポンスの内容は保持しない
+            result = self.invoke_agent(session, payload, collect=False)
             
             result.update({
                 'invocation_number': i,
                 'prompt': prompt
             })
-            results.append(result)
             
             if result['status'] == 'success':
                 logger.info(f"✅ Invocation {i} completed successfully")
             else:
                 logger.error(f"❌ Invocation {i} failed: {result['error']}")
+            return result
+
+        if parallel:
+            # 共有クライアント（スレッドセーフ）で並列に呼び出し、結果はプロンプトの順序で返す
+            with ThreadPoolExecutor(max_workers=len(test_prompts)) as executor:
+                results = list(executor.map(invoke, range(1, len(test_prompts) + 1), test_prompts))
+        else:
+            results = [invoke(i, prompt) for i, prompt in enumerate(test_prompts, 1)]
         
         return {
-            'session_id': session_id,
+            'session_id': session.session_id,
             'user_id': user_id,
             'total_invocations': len(test_prompts),
             'results': results
@@ -118,35 +194,13 @@ class ObservabilityTester:
         content = []
         
         if "text/event-stream" in response.get("contentType", ""):
-            # ストリーミングレスポンスを処理 - バイトバッファ使用
-            byte_buffer = b''
-            for line in response["response"].iter_lines(chunk_size=10):
+            # ストリーミングレスポンスを処理 - 各行のペイロードを1つのバイトバッファに連結し、最後に一度だけデコード
+            # （行をまたぐマルチバイト文字もそのまま復元され、無効なバイトは読み飛ばす）
+            raw = bytearray()
+            for line in _iter_stream_lines(response["response"]):
                 if line:
-                    byte_buffer += line
-                    # 完全なUTF-8文字のみをデコード
-                    while byte_buffer:
-                        try:
-                            decoded = byte_buffer.decode('utf-8')
-                            if decoded.startswith("data: "):
-                                decoded = decoded[6:]
-                            content.append(decoded)
-                            byte_buffer = b''
-                            break
-                        except UnicodeDecodeError as e:
-                            # 不完全なバイト列の場合、次のチャンクを待つ
-                            if e.start == 0:
-                                # 最初から無効な場合は1バイト削除
-                                byte_buffer = byte_buffer[1:]
-                            else:
-                                # 有効な部分をデコードして残りを保持
-                                valid_part = byte_buffer[:e.start]
-                                if valid_part:
-                                    decoded = valid_part.decode('utf-8')
-                                    if decoded.startswith("data: "):
-                                        decoded = decoded[6:]
-                                    content.append(decoded)
-                                byte_buffer = byte_buffer[e.start:]
-                                break
+                    raw += line.removeprefix(b"data: ")
+            content.append(raw.decode('utf-8', errors='ignore'))
         
         elif response.get("contentType") == "application/json":
             # JSONレスポンスを処理 - 全体を結合してからデコード
@@ -159,6 +213,12 @@ class ObservabilityTester:
         
         return ''.join(content)
     
+    def _drain_response(self, response: Dict[str, Any]) -> None:
+        """レスポンスを読み切って破棄（内容を保持・デコードしないためメモリ使用量は出力サイズに依存しない）"""
+        body = response.get("response", [])
+        chunks = body.iter_chunks(chunk_size=STREAM_CHUNK_SIZE) if hasattr(body, "iter_chunks") else body
+        deque(chunks, maxlen=0)
+    
     # def _process_response(self, response: Dict[str, Any]) -> str:
     #     """AgentCoreランタイムレスポンスを処理"""
     #     content = []
@@ -183,6 +243,35 @@ class ObservabilityTester:
     #     return ''.join(content)
 
 
+def _iter_stream_lines(stream, chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    ストリーミングレスポンスを大きなチャンクで読み込み、行ごとに返す
+
+    行の分割はチャンクごとにbytes.splitで一度に行い、チャンクをまたぐ行の断片だけを保持して連結する
+    """
+    pending = []
+    for chunk in stream.iter_chunks(chunk_size=chunk_size):
+        *lines, tail = chunk.split(b'\n')
+        if lines:
+            if pending:
+                pending.append(lines[0])
+                lines[0] = b''.join(pending)
+                pending = []
+            for line in lines:
+                yield line.rstrip(b'\r')
+        pending.append(tail)
+    last = b''.join(pending)
+    if last:
+        yield last.rstrip(b'\r')
+
+
+@lru_cache(maxsize=4)
+def _parse_yaml(path: str, mtime_ns: int) -> dict:
+    """YAMLファイルを解析（パスと更新日時が同じ間は解析結果を再利用）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=_YAMLLoader)
+
+
 def load_agent_arn() -> str:
     """.bedrock_agentcore.yamlからエージェントARNを読み込み"""
     yaml_path = Path("../02_runtime/.bedrock_agentcore.yaml")
@@ -190,8 +279,7 @@ def load_agent_arn() -> str:
     if not yaml_path.exists():
         raise FileNotFoundError(f"Configuration file not found: {yaml_path}")
     
-    with open(yaml_path, 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
+    config = _parse_yaml(str(yaml_path), yaml_path.stat().st_mtime_ns) or {}
     
     default_agent = config.get('default_agent')
     if not default_agent:
@@ -208,6 +296,14 @@ def load_agent_arn() -> str:
 
 def main():
     """可観測性テストを実行するメイン関数"""
+    parser = argparse.ArgumentParser(description='Test AgentCore Observability')
+    parser.add_argument(
+        '--parallel',
+        action='store_true',
+        help='Invoke the test prompts concurrently in the same session'
+    )
+    args = parser.parse_args()
+
     logger.info("🚀 Starting AgentCore Observability Tests")
     
     try:
@@ -225,7 +321,7 @@ def main():
         logger.info("\n" + "="*60)
         logger.info("Invoke test invocations in Same Session")
         logger.info("="*60)
-        tester.test_multiple_invocations_same_session("user0001")
+        tester.test_multiple_invocations_same_session("user0001", parallel=args.parallel)
         
     except Exception as e:
         logger.error(f"❌ Test execution failed: {e}")
@@ -1,15 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import boto3
 from bedrock_agentcore.memory import MemoryClient
 
+MEMORY_NAME_PREFIX = "cost_estimator_memory"
+LIST_PAGE_SIZE = 50
+
+
+def _iter_memory_ids(control_client, prefix):
+    """list_memoriesをページ単位で取得し、接頭辞に一致するメモリIDを順に返す"""
+    kwargs = {"maxResults": LIST_PAGE_SIZE}
+    while True:
+        response = control_client.list_memories(**kwargs)
+        for memory in response.get("memories", []):
+            memory_id = memory.get("id") or ""
+            if memory_id.startswith(prefix):
+                yield memory_id
+        next_token = response.get("nextToken")
+        if not next_token:
+            return
+        kwargs["nextToken"] = next_token
+
 
 def clean_resources():
-    region = boto3.Session().region_name
+    session = boto3.Session()
+    region = session.region_name
     client = MemoryClient(region_name=region)
-    for memory in client.list_memories():
-        memory_id = memory.get("id")
-        if memory_id.startswith("cost_estimator_memory"):
-            print(f"Delete {memory_id}.")
-            client.delete_memory_and_wait(memory_id)
+    control_client = session.client("bedrock-agentcore-control", region_name=region)
+
+    def delete_memory(memory_id):
+        print(f"Delete {memory_id}.")
+        client.delete_memory_and_wait(memory_id)
+
+    # 各メモリの削除完了待ちは独立しているため並列に実行
+    # （一覧はページごとに取得し、取得したメモリから順に削除を開始）
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(delete_memory, _iter_memory_ids(control_client, MEMORY_NAME_PREFIX)))
+
+    # 削除したメモリのIDをキャッシュから破棄
+    Path(".memory_cache.json").unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
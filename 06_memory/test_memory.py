@@ -20,8 +20,17 @@ import logging
 import traceback
 import argparse
 import json
+import hashlib
+import io
+import itertools
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
-from datetime import datetime
+from botocore.config import Config
+from functools import lru_cache
+from pathlib import Path
 
 # デバッグと監視用のログ設定
 logging.basicConfig(
@@ -38,6 +47,32 @@ from strands import Agent, tool  # noqa: E402
 from bedrock_agentcore.memory.client import MemoryClient  # noqa: E402
 from cost_estimator_agent.cost_estimator_agent import AWSCostEstimatorAgent  # noqa: E402
 
+# Bedrock Runtimeの接続設定（compare・proposeから続けて呼ばれるConverse呼び出しでTLS接続を再利用し、
+# スロットリングにはアダプティブリトライで対応）
+_BEDROCK_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 5}
+)
+
+MEMORY_NAME = "cost_estimator_memory"
+LIST_PAGE_SIZE = 50  # メモリ一覧を取得する際の1ページあたりの件数
+EVENT_BATCH_SIZE = 10  # 保存待ちの見積もりがこの件数に達したら読み出しを待たずに短期メモリへ保存
+ESTIMATE_CACHE_SIZE = 64  # セッション内で再利用する見積もり結果の最大件数
+# コスト見積もりエージェントが見積もりを得られなかった場合に返すメッセージ（見積もり結果としてキャッシュしない）
+NO_ESTIMATE_RESULTS = frozenset({"No text content found.", "No estimation result."})
+# 解決済みのメモリIDのキャッシュ（次回の起動でメモリ一覧の取得を省略）
+MEMORY_CACHE_FILE = Path(".memory_cache.json")
+
+# 長期メモリから好みを取得する際のクエリ（要件に関連する好みを意味検索で取得）
+PREFERENCES_QUERY_TEMPLATE = "User preferences and decision patterns for: {requirements}"
+PREFERENCES_TOP_K = 3  # 提案に使う好みの最大件数
+
+# Bedrockでの生成の出力トークン上限（入力件数に応じて必要な分だけ確保し、生成時間を抑える）
+MAX_OUTPUT_TOKENS = 4000
+BASE_OUTPUT_TOKENS = 800
+OUTPUT_TOKENS_PER_ITEM = 600
+
 # プロンプトテンプレート
 SYSTEM_PROMPT = """あなたはメモリ機能付きAWSコスト見積もりエージェントです。
 
@@ -63,6 +98,12 @@ COMPARISON_PROMPT_TEMPLATE = """以下のAWSコスト見積もりを比較し、
 4. 比較に基づいた推奨事項
 """
 
+ESTIMATE_TEMPLATE = """## Estimate
+**Input:**:
+{input}
+**Output:**:
+{output}"""
+
 PROPOSAL_PROMPT_TEMPLATE = """以下に基づいてAWSアーキテクチャ提案を生成してください:
 
 ユーザー要件: {requirements}
@@ -82,6 +123,49 @@ PROPOSAL_PROMPT_TEMPLATE = """以下に基づいてAWSアーキテクチャ提
 """
 
 
+# Python 3.14以降ではuuid.uuid7、それ以前はuuid.uuid4
+_new_session_uuid = getattr(uuid, "uuid7", uuid.uuid4)
+
+
+@lru_cache(maxsize=4)
+def _boto_session(region: str = "") -> boto3.Session:
+    """リージョンごとに共有するboto3セッション（認証情報と設定ファイルの解決はプロセス内で一度だけ）"""
+    return boto3.Session(region_name=region or None)
+
+
+# boto3のセッションはスレッドセーフではないため、共有セッションからのクライアント作成を直列化
+_SESSION_LOCK = threading.Lock()
+
+
+def _output_token_budget(item_count: int) -> int:
+    """比較・提案の対象件数から生成の出力トークン上限を算出"""
+    return min(MAX_OUTPUT_TOKENS, BASE_OUTPUT_TOKENS + OUTPUT_TOKENS_PER_ITEM * item_count)
+
+
+def _iter_messages(event: dict):
+    """イベントのペイロードから会話メッセージの（ロール, テキスト）を出現順に返す"""
+    for payload in event.get('payload', ()):
+        message = payload.get('conversational')
+        if message:
+            yield message.get('role'), message['content']['text']
+
+
+def _extract_estimate_pairs(event: dict) -> list:
+    """
+    イベントのペイロードから（入力, 出力）の組を取り出す
+
+    1つのイベントに複数の見積もりがまとめて保存されている場合は、USERとASSISTANTの
+    メッセージを出現順に組にして、すべての見積もりを返す
+    """
+    # 同じイテレータを2つzipし、連続する2件のメッセージを1回の走査で組にする
+    messages = _iter_messages(event)
+    return [
+        (user_text, assistant_text)
+        for (user_role, user_text), (assistant_role, assistant_text) in zip(messages, messages)
+        if user_role == 'USER' and assistant_role == 'ASSISTANT'
+    ]
+
+
 class AgentWithMemory:
     """
     AgentCoreメモリ機能で強化されたAWSコスト見積もりエージェント
@@ -103,72 +187,37 @@ class AgentWithMemory:
             force_recreate: Trueの場合、既存のメモリを削除して新しいものを作成
         """
         self.actor_id = actor_id
-        self.region = region
-        if not self.region:
-            # 指定されていない場合はboto3セッションからデフォルトリージョンを使用
-            self.region = boto3.Session().region_name
+        # 認証情報と設定ファイルの解決を一度で済ませるため、クライアントはインスタンス間で共有するセッションから作成
+        self._boto_session = _boto_session(region)
+        # 指定されていない場合はboto3セッションのデフォルトリージョンを使用
+        self.region = self._boto_session.region_name
         self.force_recreate = force_recreate
         self.memory_id = None
         self.memory = None
         self.memory_client = None
         self.agent = None
         self.bedrock_runtime = None
-        self.session_id = f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        # 見積もり間で再利用するコスト見積もりエージェント（見積もりは並列に実行され得るため、スレッドごとに初回使用時に作成）
+        self._local = threading.local()
+        # 短期メモリへの保存待ちの見積もり（入力, 出力）。読み出し前と終了時にまとめて保存
+        self._pending_events = []
+        self._pending_lock = threading.Lock()
+        # プロンプトのハッシュをキーとしたBedrockの生成結果（このインスタンスの間のみ保持）
+        self._bedrock_cache = {}
+        # 正規化したアーキテクチャ説明のハッシュをキーとした見積もり結果（最大ESTIMATE_CACHE_SIZE件、古いものから破棄）
+        self._estimate_cache = OrderedDict()
+        self._estimate_cache_lock = threading.Lock()
+        # 別プロセスで同時に作成されてもセッションIDが重複しないようUUIDを使用
+        # （時刻順に並ぶUUIDv7が利用可能な場合はそれを使用）
+        self.session_id = f"session-{_new_session_uuid().hex}"
         
         logger.info(f"Initializing AgentWithMemory for actor: {actor_id}")
         if force_recreate:
             logger.info("🔄 Force recreate mode enabled - will delete existing memory")
         
-        # ユーザー設定戦略でAgentCoreメモリを初期化
+        # メモリとBedrock Runtimeクライアントは使用する時点で初期化（_ensure_memory・_ensure_bedrock）
+        self._init_lock = threading.Lock()
         try:
-            logger.info("Initializing AgentCore Memory...")
-            self.memory_client = MemoryClient(region_name=self.region)
-            
-            # メモリが既に存在するかチェック
-            memory_name = "cost_estimator_memory"
-            existing_memories = self.memory_client.list_memories()
-            existing_memory = None
-            for memory in existing_memories:
-                if memory.get('memoryId').startswith(memory_name):
-                    existing_memory = memory
-                    break
-
-            if existing_memory:
-                if not force_recreate:
-                    # 既存メモリを再利用（デフォルト動作）
-                    self.memory_id = existing_memory.get('id')
-                    self.memory = existing_memory
-                    logger.info(f"🔄 Reusing existing memory: {memory_name} (ID: {self.memory_id})")
-                    logger.info("✅ Memory reuse successful - skipping creation time!")
-                else:            
-                    # force_recreateがTrueの場合は既存メモリを削除
-                    memory_id_to_delete = existing_memory.get('id')
-                    logger.info(f"🗑️ Force deleting existing memory: {memory_name} (ID: {memory_id_to_delete})")
-                    self.memory_client.delete_memory_and_wait(memory_id_to_delete, max_wait=300)
-                    logger.info("✅ Existing memory deleted successfully")
-                    existing_memory = None
-
-            if existing_memory is None:
-                # 新しいメモリを作成
-                logger.info("Creating new AgentCore Memory...")
-                self.memory = self.memory_client.create_memory_and_wait(
-                    name=memory_name,
-                    strategies=[{
-                        "userPreferenceMemoryStrategy": {
-                            "name": "UserPreferenceExtractor",
-                            "description": "Extracts user preferences for AWS architecture decisions",
-                            "namespaces": [f"/preferences/{self.actor_id}"]
-                        }
-                    }],
-                    event_expiry_days=7,  # 許可される最小値
-                )
-                self.memory_id = self.memory.get('memoryId')
-                logger.info(f"✅ AgentCore Memory created successfully with ID: {self.memory_id}")
-
-            # AI機能用のBedrock Runtimeクライアントを初期化
-            self.bedrock_runtime = boto3.client('bedrock-runtime', region_name=self.region)
-            logger.info("✅ Bedrock Runtime client initialized")
-            
             # コスト見積もりツールとコールバックハンドラーでエージェントを作成
             self.agent = Agent(
                 tools=[self.estimate, self.compare, self.propose],
@@ -178,6 +227,123 @@ class AgentWithMemory:
         except Exception as e:
             logger.exception(f"❌ Failed to initialize AgentWithMemory: {e}")
 
+    def _ensure_memory(self) -> bool:
+        """
+        AgentCoreメモリを初回使用時に初期化し、利用可能かどうかを返す
+
+        見積もりのみで終了する場合にメモリの検索・作成を待たずに済むよう、メモリの読み書きの直前に呼び出す
+        """
+        with self._init_lock:
+            if self.memory_client and self.memory_id:
+                return True
+            # ユーザー設定戦略でAgentCoreメモリを初期化
+            try:
+                logger.info("Initializing AgentCore Memory...")
+                self.memory_client = MemoryClient(region_name=self.region)
+                
+                # メモリが既に存在するかチェック
+                memory_name = MEMORY_NAME
+                existing_memory = self._find_existing_memory(memory_name)
+
+                if existing_memory:
+                    if not self.force_recreate:
+                        # 既存メモリを再利用（デフォルト動作）
+                        self.memory_id = existing_memory.get('id')
+                        self.memory = existing_memory
+                        self._save_cached_memory_id(self.memory_id)
+                        logger.info(f"🔄 Reusing existing memory: {memory_name} (ID: {self.memory_id})")
+                        logger.info("✅ Memory reuse successful - skipping creation time!")
+                    else:            
+                        # force_recreateがTrueの場合は既存メモリを削除
+                        memory_id_to_delete = existing_memory.get('id')
+                        logger.info(f"🗑️ Force deleting existing memory: {memory_name} (ID: {memory_id_to_delete})")
+                        self.memory_client.delete_memory_and_wait(memory_id_to_delete, max_wait=300)
+                        logger.info("✅ Existing memory deleted successfully")
+                        existing_memory = None
+
+                if existing_memory is None:
+                    # 新しいメモリを作成
+                    logger.info("Creating new AgentCore Memory...")
+                    self.memory = self.memory_client.create_memory_and_wait(
+                        name=memory_name,
+                        strategies=[{
+                            "userPreferenceMemoryStrategy": {
+                                "name": "UserPreferenceExtractor",
+                                "description": "Extracts user preferences for AWS architecture decisions",
+                                "namespaces": [f"/preferences/{self.actor_id}"]
+                            }
+                        }],
+                        event_expiry_days=7,  # 許可される最小値
+                    )
+                    self.memory_id = self.memory.get('memoryId')
+                    self._save_cached_memory_id(self.memory_id)
+                    logger.info(f"✅ AgentCore Memory created successfully with ID: {self.memory_id}")
+                return True
+                
+            except Exception as e:
+                logger.exception(f"❌ Failed to initialize AgentCore Memory: {e}")
+                return False
+
+    def _ensure_bedrock(self):
+        """AI機能用のBedrock Runtimeクライアントを初回使用時に初期化（接続を再利用する設定で作成）"""
+        with self._init_lock:
+            if self.bedrock_runtime is None:
+                with _SESSION_LOCK:
+                    self.bedrock_runtime = self._boto_session.client('bedrock-runtime', config=_BEDROCK_CONFIG)
+                logger.info("✅ Bedrock Runtime client initialized")
+        return self.bedrock_runtime
+
+    def _find_existing_memory(self, memory_name: str):
+        """既存のメモリを検索（キャッシュしたメモリIDが有効な場合はメモリ一覧の取得を省略）"""
+        memory_id = self._load_cached_memory_id(memory_name)
+        if memory_id:
+            try:
+                if self.memory_client.get_memory_status(memory_id) == "ACTIVE":
+                    logger.info(f"⚡ Found cached memory ID: {memory_id}")
+                    return {"id": memory_id, "memoryId": memory_id}
+            except Exception as e:
+                logger.info(f"Cached memory ID is no longer valid: {e}")
+
+        # 一覧はページ単位で取得し、最初に一致した時点で以降のページは取得しない（IDがNoneのメモリは一致しない）
+        return next(
+            (memory for memory in self._iter_memories() if (memory.get('id') or '').startswith(memory_name)),
+            None
+        )
+
+    def _iter_memories(self):
+        """コントロールプレーンのlist_memoriesをページ単位（最大LIST_PAGE_SIZE件）で取得し、メモリの概要を順に返す"""
+        with _SESSION_LOCK:
+            control_client = self._boto_session.client('bedrock-agentcore-control')
+        kwargs = {"maxResults": LIST_PAGE_SIZE}
+        while True:
+            response = control_client.list_memories(**kwargs)
+            yield from response.get("memories", [])
+            next_token = response.get("nextToken")
+            if not next_token:
+                return
+            kwargs["nextToken"] = next_token
+
+    def _load_cached_memory_id(self, memory_name: str):
+        """キャッシュしたメモリIDを読み込み（リージョンまたはメモリ名が異なる場合はNone）"""
+        try:
+            cache = json.loads(MEMORY_CACHE_FILE.read_bytes())
+        except (OSError, ValueError):
+            return None
+        if cache.get("region") != self.region or cache.get("memory_name") != memory_name:
+            return None
+        return cache.get("memory_id")
+
+    def _save_cached_memory_id(self, memory_id: str):
+        """次回の起動でメモリ一覧の取得を省略できるようメモリIDをキャッシュ"""
+        try:
+            MEMORY_CACHE_FILE.write_text(json.dumps({
+                "region": self.region,
+                "memory_name": MEMORY_NAME,
+                "memory_id": memory_id
+            }))
+        except OSError as e:
+            logger.warning(f"⚠️ Failed to cache memory ID: {e}")
+
     def __enter__(self):
         """コンテキストマネージャーのエントリ"""
         return self.agent
@@ -187,18 +353,49 @@ class AgentWithMemory:
         # デバッグを高速化するためにデフォルトでメモリを保持
         # 必要に応じて --force でメモリを再作成
         try:
+            # 保存待ちの見積もりを短期メモリに書き込む
+            self.flush_events()
+            self._bedrock_cache.clear()
+            self._estimate_cache.clear()
             if self.memory_client and self.memory_id:
                 logger.info("🧹 Memory preserved for reuse (use --force to recreate)")
                 logger.info("✅ Context manager exit completed")
         except Exception as e:
             logger.warning(f"⚠️ Error in context manager exit: {e}")
 
+    def flush_events(self):
+        """保存待ちの見積もりを1回のcreate_eventでまとめて短期メモリに保存"""
+        with self._pending_lock:
+            pending, self._pending_events = self._pending_events, []
+        if not pending or not self._ensure_memory():
+            return
+
+        messages = []
+        for architecture_description, result in pending:
+            messages.append((architecture_description, "USER"))
+            messages.append((result, "ASSISTANT"))
+        try:
+            logger.info(f"Store {len(pending)} estimate(s) to short term memory")
+            self.memory_client.create_event(
+                memory_id=self.memory_id,
+                actor_id=self.actor_id,
+                session_id=self.session_id,
+                messages=messages
+            )
+        except Exception:
+            # 保存に失敗した見積もりは次回の保存で再試行できるようバッファに戻す
+            with self._pending_lock:
+                self._pending_events[:0] = pending
+            raise
+
     def list_memory_events(self, max_results: int = 10):
         """デバッグ用にメモリイベントを検査するヘルパーメソッド"""
         try:
-            if not self.memory_client or not self.memory_id:
+            if not self._ensure_memory():
                 return "❌ Memory not available"
             
+            self.flush_events()
+            
             events = self.memory_client.list_events(
                 memory_id=self.memory_id,
                 actor_id=self.actor_id,
@@ -207,8 +404,10 @@ class AgentWithMemory:
             )
             
             logger.info(f"📋 Found {len(events)} events in memory")
-            for i, event in enumerate(events):
-                logger.info(f"Event {i+1}: {json.dumps(event, indent=2, default=str)}")
+            # 各イベントの内容はDEBUGレベルで出力し、整形はそのログが出力される場合のみ行う
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, event in enumerate(events, 1):
+                    logger.debug("Event %d: %s", i, json.dumps(event, indent=2, default=str, ensure_ascii=False))
             
             return events
         except Exception as e:
@@ -229,20 +428,37 @@ class AgentWithMemory:
         try:
             logger.info(f"🔍 Estimating costs for: {architecture_description}")
             
-            # 既存のコスト見積もりエージェントを使用
-            cost_estimator = AWSCostEstimatorAgent(region=self.region)
-            result = cost_estimator.estimate_costs(architecture_description)
-            # メモリにイベントを保存
-            logger.info("Store event to short term memory")
-            self.memory_client.create_event(
-                memory_id=self.memory_id,
-                actor_id=self.actor_id,
-                session_id=self.session_id,
-                messages=[
-                    (architecture_description, "USER"),
-                    (result, "ASSISTANT")
-                ]
-            )
+            # 同じアーキテクチャ（空白・大文字小文字の違いは無視）の見積もり結果があれば再利用
+            cache_key = hashlib.blake2b(" ".join(architecture_description.split()).lower().encode()).hexdigest()
+            with self._estimate_cache_lock:
+                result = self._estimate_cache.get(cache_key)
+                if result is not None:
+                    self._estimate_cache.move_to_end(cache_key)
+            if result is not None:
+                logger.info("✅ Reusing the cost estimate for the same architecture")
+            else:
+                # 既存のコスト見積もりエージェントを使用（スレッドごとに初回のみ作成し、以降の見積もりで再利用）
+                cost_estimator = getattr(self._local, "cost_estimator", None)
+                if cost_estimator is None:
+                    cost_estimator = self._local.cost_estimator = AWSCostEstimatorAgent(region=self.region)
+                result = cost_estimator.estimate_costs(architecture_description)
+                # 失敗時や結果が空の場合のメッセージはキャッシュせず、実際の見積もり結果のみを保存
+                if not result.startswith("❌") and result not in NO_ESTIMATE_RESULTS:
+                    with self._estimate_cache_lock:
+                        self._estimate_cache[cache_key] = result
+                        if len(self._estimate_cache) > ESTIMATE_CACHE_SIZE:
+                            self._estimate_cache.popitem(last=False)
+            # メモリへの保存はバッファし、メモリの読み出し前または終了時にまとめて保存（再利用した結果も比較の対象として保存）
+            # （バッファがEVENT_BATCH_SIZE件に達した場合はその時点で1回のcreate_eventで保存）
+            with self._pending_lock:
+                self._pending_events.append((architecture_description, result))
+                batch_full = len(self._pending_events) >= EVENT_BATCH_SIZE
+            if batch_full:
+                try:
+                    self.flush_events()
+                except Exception as e:
+                    # 保存できなかった見積もりはバッファに残り、次回の保存で再試行される
+                    logger.warning(f"⚠️ Failed to store buffered estimates: {e}")
 
             # メモリフックがこのインタラクションを自動的に保存
             logger.info("✅ Cost estimation completed")
@@ -265,10 +481,11 @@ class AgentWithMemory:
         """
         logger.info("📊 Retrieving estimates for comparison...")
         
-        if not self.memory_client or not self.memory_id:
+        if not self._ensure_memory():
             return "❌ Memory not available for comparison"
         
-        # メモリから最近の見積もりイベントを取得
+        # 保存待ちの見積もりを書き込んでから、メモリから最近の見積もりイベントを取得
+        self.flush_events()
         events = self.memory_client.list_events(
             memory_id=self.memory_id,
             actor_id=self.actor_id,
@@ -277,51 +494,41 @@ class AgentWithMemory:
         )
         
         # 見積もりツール呼び出しをフィルタリングして解析
-        estimates = []
+        pairs = []
         for event in events:
             try:
-                # ペイロードデータを抽出
-                _input = ""
-                _output = ""
-                for payload in event.get('payload', []):
-                    if 'conversational' in payload:
-                        _message = payload['conversational']
-                        _role = _message.get('role', 'unknown')
-                        _content = _message.get('content')["text"]
-
-                        if _role == 'USER':
-                            _input = _content
-                        elif _role == 'ASSISTANT':
-                            _output = _content
-                    
-                    if _input and _output:
-                        estimates.append(
-                            "\n".join([
-                                "## Estimate",
-                                f"**Input:**:\n{_input}",
-                                f"**Output:**:\n{_output}"
-                            ])
-                        )
-                        _input = ""
-                        _output = ""
-
+                pairs.extend(_extract_estimate_pairs(event))
             except Exception as parse_error:
                 logger.warning(f"Failed to parse event: {parse_error}")
                 continue
+        # 見積もりごとの文字列を一時的なリストに溜めず、1つのバッファに直接書き込む
+        estimates = io.StringIO()
+        count = 0
+        for _input, _output in pairs:
+            if not (_input and _output):
+                continue
+            if count:
+                estimates.write("\n\n")
+            estimates.write(ESTIMATE_TEMPLATE.format(input=_input, output=_output))
+            count += 1
         
-        if not estimates:
+        if not count:
             raise Exception("ℹ️ No previous estimates found for comparison. Please run some estimates first.") 
         
         # Bedrockを使用して比較を生成
-        logger.info(f"🔍 Comparing {len(estimates)} estimates... {estimates}")
+        estimates_text = estimates.getvalue()
+        # 見積もり全文を含むため、ログが出力される場合のみ文字列を組み立てる（%形式の遅延フォーマット）
+        logger.info("🔍 Comparing %d estimates... %s", count, estimates_text)
         comparison_prompt = COMPARISON_PROMPT_TEMPLATE.format(
             request=request,
-            estimates="\n\n".join(estimates)
+            estimates=estimates_text
         )
         
-        comparison_result = self._generate_with_bedrock(comparison_prompt)
+        comparison_result = self._generate_with_bedrock(
+            comparison_prompt, cache=True, max_tokens=_output_token_budget(count)
+        )
         
-        logger.info(f"✅ Comparison completed for {len(estimates)} estimates")
+        logger.info(f"✅ Comparison completed for {count} estimates")
         return comparison_result
 
     @tool
@@ -338,26 +545,39 @@ class AgentWithMemory:
         try:
             logger.info("💡 Generating architecture proposal based on user history...")
             
-            if not self.memory_client or not self.memory_id:
+            if not self._ensure_memory():
                 return "❌ Memory not available for personalized recommendations"
             
-            # 長期メモリからユーザーの好みとパターンを取得
-            memories = self.memory_client.retrieve_memories(
-                memory_id=self.memory_id,
-                namespace=f"/preferences/{self.actor_id}",
-                query=f"User preferences and decision patterns for: {requirements}",
-                top_k=3
-            )
-            contents = [memory.get('content', {}).get('text', '') for memory in memories]
+            # 保存待ちの見積もりを書き込み、好みの抽出対象に含める
+            # （好みの抽出はサービス側で非同期に行われ、書き込んだ見積もりが直後の検索に現れることはないため、
+            #   書き込みの完了を待たずに長期メモリの検索を並行して行う）
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                flush_future = executor.submit(self.flush_events)
+                
+                # 長期メモリから要件に関連するユーザーの好みとパターンを取得
+                memories = self.memory_client.retrieve_memories(
+                    memory_id=self.memory_id,
+                    namespace=f"/preferences/{self.actor_id}",
+                    query=PREFERENCES_QUERY_TEMPLATE.format(requirements=requirements),
+                    top_k=PREFERENCES_TOP_K
+                )
+                memories = list(itertools.islice(memories, PREFERENCES_TOP_K))
+                flush_future.result()
+            # 件数を上限で打ち切り、中間リストを作らずに履歴データの文字列を組み立てる
+            historical_data = "\n".join(
+                memory.get('content', {}).get('text', '') for memory in memories
+            ) or "No historical data available"
 
             # Bedrockを使用して提案を生成
-            logger.info(f"🔍 Generating proposal with requirements: {requirements}\nHistorical data: {contents}")
+            logger.info("🔍 Generating proposal with requirements: %s\nHistorical data: %s", requirements, historical_data)
             proposal_prompt = PROPOSAL_PROMPT_TEMPLATE.format(
                 requirements=requirements,
-                historical_data="\n".join(contents) if memories else "No historical data available"
+                historical_data=historical_data
             )
             
-            proposal = self._generate_with_bedrock(proposal_prompt)
+            proposal = self._generate_with_bedrock(
+                proposal_prompt, cache=True, max_tokens=_output_token_budget(len(memories))
+            )
             
             logger.info("✅ Architecture proposal generated")
             return proposal
@@ -366,19 +586,31 @@ class AgentWithMemory:
             logger.exception(f"❌ Proposal generation failed: {e}")
             return f"❌ Proposal generation failed: {e}"
 
-    def _generate_with_bedrock(self, prompt: str) -> str:
+    def _generate_with_bedrock(self, prompt: str, cache: bool = False,
+                               max_tokens: int = 1500, temperature: float = 0.3) -> str:
         """
         Amazon Bedrock Converse APIを使用してコンテンツを生成
         
         Args:
             prompt: Bedrockに送信するプロンプト
+            cache: Trueの場合、同じプロンプトに対する生成結果をこのインスタンスの間再利用する
+            max_tokens: 生成する最大トークン数
+            temperature: 生成時のtemperature
             
         Returns:
             Bedrockから生成されたコンテンツ
         """
+        # 高速でコスト効率の良い生成にClaude 3 Haikuを使用
+        model_id = "anthropic.claude-3-haiku-20240307-v1:0"
+        cache_key = (
+            hashlib.blake2b(f"{model_id}\0{max_tokens}\0{temperature}\0{prompt}".encode()).hexdigest()
+            if cache else None
+        )
+        if cache_key in self._bedrock_cache:
+            logger.info("✅ Reusing the generated content for the same prompt")
+            return self._bedrock_cache[cache_key]
+
         try:
-            # 高速でコスト効率の良い生成にClaude 3 Haikuを使用
-            model_id = "anthropic.claude-3-haiku-20240307-v1:0"
             
             # メッセージを準備
             messages = [
@@ -389,12 +621,12 @@ class AgentWithMemory:
             ]
             
             # Converse APIを使用してモデルを呼び出し
-            response = self.bedrock_runtime.converse(
+            response = self._ensure_bedrock().converse(
                 modelId=model_id,
                 messages=messages,
                 inferenceConfig={
-                    "maxTokens": 4000,
-                    "temperature": 0.9
+                    "maxTokens": max_tokens,
+                    "temperature": temperature
                 }
             )
             
@@ -402,6 +634,9 @@ class AgentWithMemory:
             output_message = response['output']['message']
             generated_text = output_message['content'][0]['text']
             
+            # 失敗時のフォールバックはキャッシュせず、成功した生成結果のみを保存
+            if cache_key:
+                self._bedrock_cache[cache_key] = generated_text
             return generated_text
             
         except Exception as e:
@@ -438,7 +673,8 @@ def main():
     
     try:
         # 適切なクリーンアップを確実にするためにコンテキストマネージャーを使用
-        with AgentWithMemory(actor_id="user123", force_recreate=args.force) as agent:
+        memory_agent = AgentWithMemory(actor_id="user123", force_recreate=args.force)
+        with memory_agent as agent:
             print("\n📝 Running cost estimates for different architectures...")
             
             # 3つの異なるアーキテクチャのコストを見積もり
@@ -448,13 +684,20 @@ def main():
             ]
             
             print("\n🔍 Generating estimates...")
-            for i, architecture in enumerate(architectures, 1):
-                print(f"\n--- Estimate #{i} ---")
-                result = agent(f"Please estimate architecture: {architecture}")
-                print(result)
-                result_text = result.message["content"] if result.message else "No estimation result."
-                print(f"Architecture: {architecture}")
-                print(f"Result: {result_text[:200]}..." if len(result_text) > 200 else result_text)
+            # 各見積もりは独立しているため並列に実行
+            # （エージェントの会話状態は並列の呼び出しで共有できないため、見積もりツールを直接呼び出す。
+            #   結果は短期メモリに保存され、以降の比較で使用される）
+            with ThreadPoolExecutor(max_workers=len(architectures)) as executor:
+                futures = {
+                    executor.submit(memory_agent.estimate, architecture): (i, architecture)
+                    for i, architecture in enumerate(architectures, 1)
+                }
+                for future in as_completed(futures):
+                    i, architecture = futures[future]
+                    result_text = future.result()
+                    print(f"\n--- Estimate #{i} ---")
+                    print(f"Architecture: {architecture}")
+                    print(f"Result: {result_text[:200]}..." if len(result_text) > 200 else result_text)
 
             print("\n" + "="*60)
             print("📊 Comparing all estimates...")